@@ -1,14 +1,19 @@
+import numpy as np
 import pandas as pd
 
+from clueval.spans_table import SentenceIndex
+
 class ErrorTable:
-    def __init__(self, match_table: pd.DataFrame, candidate_table: pd.DataFrame, token_position_sentence_mapping:dict):
+    def __init__(self, match_table: pd.DataFrame, candidate_table: pd.DataFrame, token_position_sentence_mapping: dict | SentenceIndex):
         self.match_table = match_table
         self.candidate_table = candidate_table
+        if isinstance(token_position_sentence_mapping, dict):
+            token_position_sentence_mapping = SentenceIndex.from_mapping(token_position_sentence_mapping)
         self.token_position_sentence_mapping = token_position_sentence_mapping
     
     def __call__(self,  annotation_layer:str|list[str], windows:int=10):
         overlaps = []
-        intermediate_table = self.match_table[["start", "end", "token_id_start", "token_id_end", "domain", "text", "status"] + [layer for layer in annotation_layer if not layer.endswith("_Y")]].copy()
+        intermediate_table = self.match_table[["start", "end", "token_id_start", "token_id_end", "doc_id", "domain", "text", "status"] + [layer for layer in annotation_layer if not layer.endswith("_Y")]].copy()
         # Check for all overlapping spans from candidate table
         for i, row in intermediate_table.iterrows():
             overlap = self.candidate_table[~((row["end"] < self.candidate_table["start"]) | (self.candidate_table["end"] < row["start"]))]
@@ -33,6 +38,9 @@ class ErrorTable:
             joined_overlap_df["token_id_start_Y"] = -100
             joined_overlap_df["token_id_end_Y"] = -100
             joined_overlap_df["text_Y"] = ""
+            for layer in annotation_layer:
+                if layer.endswith("_Y"):
+                    joined_overlap_df[layer] = None
 
         erroneous_table = self.extract_and_highlight_spans(joined_overlap_df, self.token_position_sentence_mapping, annotation_layer=annotation_layer, windows=windows)
         erroneous_table = erroneous_table[["token_id_start",
@@ -56,11 +64,18 @@ class ErrorTable:
         return erroneous_table
 
     @staticmethod
-    def extract_and_highlight_spans(input_df:pd.DataFrame, gold_sentence_mapping:dict,  annotation_layer: str|list[str], windows:int=10):
+    def extract_and_highlight_spans(input_df:pd.DataFrame, gold_sentence_mapping: dict | SentenceIndex,  annotation_layer: str|list[str], windows:int=10):
         input_df = input_df.copy()
+        if isinstance(gold_sentence_mapping, dict):
+            gold_sentence_mapping = SentenceIndex.from_mapping(gold_sentence_mapping)
         if isinstance(annotation_layer, str):
             annotation_layer = [annotation_layer]
 
+        # Number of positions shared by reference and candidate span (0 if there is no candidate span)
+        input_df["number_overlapping_tokens_with_x"] = (
+            np.minimum(input_df["end"], input_df["end_Y"]) - np.maximum(input_df["start"], input_df["start_Y"]) + 1
+        ).clip(lower=0)
+
         grouped_df = input_df.groupby(["start", "end"])
         dict_of_erroneous_spans = {"start": [],
                                    "end": [],
@@ -89,9 +104,6 @@ class ErrorTable:
 
             reference_text = group["text"].iloc[0].split()
 
-            group["number_overlapping_tokens_with_x"] = group.apply(
-                lambda r: 0 if pd.isna(r["text_Y"]) else len([token for token in r["text_Y"].split() if token in reference_text]), axis=1)
-
             # update dict_of_erroneous_spans
             dict_of_erroneous_spans["start"].append(ref_start)
             dict_of_erroneous_spans["end"].append(ref_end)
@@ -112,65 +124,64 @@ class ErrorTable:
                 else:
                     dict_of_erroneous_spans[layer].append(group[layer].iloc[0])
 
-            for j, token_ids in enumerate(gold_sentence_mapping["token_ids"]):
-                if ref_start in token_ids:
-                    sentence = gold_sentence_mapping["sents"][j]
-                    left_windows = max(0, token_ids.index(ref_start) - windows)
-                    right_windows = min(len(sentence), token_ids.index(ref_end) + windows)
-
-                    if "Züricher" in sentence:
-                        print()
-                    # Assign token status according to corpus position:
-                    # 0: Token does not belong to any span
-                    # 1: Token contained in both ref. and candidate spans
-                    # 2: Token occurs only in reference
-                    # 3: Token appears only in candidate
-                    token_status = [0] * len(token_ids)
-                    for k in range(left_windows, right_windows):
-                        token_id = token_ids[k]
-                        token_in_ref = ref_start <= token_id <= ref_end
-                        token_in_cand = token_id in cand_token_positions
-                        # Token in both reference and candidate segment
-                        if token_in_ref and token_in_cand:
-                            token_status[k] = 1
-                        # Token in reference span
-                        elif token_in_ref:
-                            token_status[k] = 2
-                        # token in candidate span
-                        elif token_in_cand:
-                            token_status[k] = 3
-
-                    # Trim context according to windows size
-                    trimmed_sentence = sentence[left_windows:right_windows]
-                    trimmed_token_status = token_status[left_windows:right_windows]
-
-                    # highlight segments
-                    si = 0
-                    while si < len(trimmed_token_status):
-                        st = trimmed_token_status[si]
-                        # Ignore tokens that do not belong to any span
-                        if st == 0:
-                            context.append(trimmed_sentence[si])
-                            si += 1
-                            continue
-                        # Determine the start and end tokens for each span based on token status
-                        sj = si
-                        while sj < len(trimmed_token_status) and trimmed_token_status[sj] == st:
-                            sj += 1
-                        segment = " ".join(trimmed_sentence[si:sj])
-                        if st == 1:
-                            context.append(f"🟩{segment}🟩") # Both ref. and cand
-                        elif st == 2:
-                            context.append(f"🟥{segment}🟥") # Ref. only
-                        elif st == 3:
-                            context.append(f"🟧{segment}🟧") # Cand. only
-                        si = sj
-
-                    context = " ".join(context)
-                    if left_windows != 0:
-                        context = "[...] " + context
-                    if right_windows != len(sentence):
-                        context += " [...]"
+            # Look up sentence that contains the span
+            j = gold_sentence_mapping.sentence_of(ref_start)
+            if j is not None:
+                token_ids, sentence = gold_sentence_mapping.sentence(j)
+                left_windows = max(0, ref_start - int(token_ids[0]) - windows)
+                right_windows = min(len(sentence), ref_end - int(token_ids[0]) + windows)
+
+                # Assign token status according to corpus position:
+                # 0: Token does not belong to any span
+                # 1: Token contained in both ref. and candidate spans
+                # 2: Token occurs only in reference
+                # 3: Token appears only in candidate
+                token_status = [0] * len(token_ids)
+                for k in range(left_windows, right_windows):
+                    token_id = token_ids[k]
+                    token_in_ref = ref_start <= token_id <= ref_end
+                    token_in_cand = token_id in cand_token_positions
+                    # Token in both reference and candidate segment
+                    if token_in_ref and token_in_cand:
+                        token_status[k] = 1
+                    # Token in reference span
+                    elif token_in_ref:
+                        token_status[k] = 2
+                    # token in candidate span
+                    elif token_in_cand:
+                        token_status[k] = 3
+
+                # Trim context according to windows size
+                trimmed_sentence = sentence[left_windows:right_windows]
+                trimmed_token_status = token_status[left_windows:right_windows]
+
+                # highlight segments
+                si = 0
+                while si < len(trimmed_token_status):
+                    st = trimmed_token_status[si]
+                    # Ignore tokens that do not belong to any span
+                    if st == 0:
+                        context.append(trimmed_sentence[si])
+                        si += 1
+                        continue
+                    # Determine the start and end tokens for each span based on token status
+                    sj = si
+                    while sj < len(trimmed_token_status) and trimmed_token_status[sj] == st:
+                        sj += 1
+                    segment = " ".join(trimmed_sentence[si:sj])
+                    if st == 1:
+                        context.append(f"🟩{segment}🟩") # Both ref. and cand
+                    elif st == 2:
+                        context.append(f"🟥{segment}🟥") # Ref. only
+                    elif st == 3:
+                        context.append(f"🟧{segment}🟧") # Cand. only
+                    si = sj
+
+                context = " ".join(context)
+                if left_windows != 0:
+                    context = "[...] " + context
+                if right_windows != len(sentence):
+                    context += " [...]"
 
             dict_of_erroneous_spans["context"].append(context)
         highlighted_error_df = pd.DataFrame.from_dict(dict_of_erroneous_spans)
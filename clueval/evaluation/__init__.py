@@ -1,10 +1,16 @@
 #!/usr/bin/env python3
 
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+
 from clueval.spans_table import Match, Convert
+from clueval.spans_table.parallel import n_workers
 from .metrics import (
     MetricsForSpansAnonymisation,
     MetricsForCategoricalSpansAnonymisation,
 )
+from .bootstrap import BootstrapMetrics
+from .significance import PairedSignificanceTest, compare_candidates
 import pandas as pd
 
 def evaluate(
@@ -19,6 +25,11 @@ def evaluate(
     categorical_evaluation: bool = False,
     categorical_head: str | list[str] | None = None,
     lenient_level: int = 0,
+    all_levels: bool = False,
+    group_by: str | list[str] | None = None,
+    doc_ids: list[str] | None = None,
+    cache_dir: str | None = None,
+    n_jobs: int = 1,
 ):
     list_of_span_evaluation = []
 
@@ -27,37 +38,44 @@ def evaluate(
     if isinstance(annotation_layer, str):
         annotation_layer = [annotation_layer]
 
-    # Convert BIO to spans tables
-    reference_converter = Convert(
-        path_reference,
-        annotation_layer=annotation_layer,
-        token_id_column=token_id_column,
-        domain_column=domain_column,
-        doc_id_column=doc_id_column,
-    )
-    reference_df = reference_converter()
+    # Convert BIO to spans tables and match them, sharing one process pool
+    pool = ProcessPoolExecutor(max_workers=n_workers(n_jobs)) if n_workers(n_jobs) > 1 else nullcontext()
+    with pool as executor:
+        reference_converter = Convert(
+            path_reference,
+            annotation_layer=annotation_layer,
+            token_id_column=token_id_column,
+            domain_column=domain_column,
+            doc_id_column=doc_id_column,
+            doc_ids=doc_ids,
+            n_jobs=n_jobs,
+            cache_dir=cache_dir,
+            executor=executor,
+        )
+        reference_df = reference_converter()
 
-    candidate_converter = Convert(
-        path_candidate,
-        annotation_layer=annotation_layer,
-        token_id_column=token_id_column,
-        domain_column=domain_column,
-        doc_id_column=doc_id_column,
-    )
-    candidate_df = candidate_converter()
+        candidate_converter = Convert(
+            path_candidate,
+            annotation_layer=annotation_layer,
+            token_id_column=token_id_column,
+            domain_column=domain_column,
+            doc_id_column=doc_id_column,
+            doc_ids=doc_ids,
+            n_jobs=n_jobs,
+            cache_dir=cache_dir,
+            executor=executor,
+        )
+        candidate_df = candidate_converter()
 
-    # Evaluation metrics
-    span_match_recall = Match(reference_df, candidate_df, annotation_layer=annotation_layer)
-    span_match_precision = Match(candidate_df, reference_df, annotation_layer=annotation_layer)
-
-    # Spans evaluation
-    matched_span_recall = span_match_recall(on=["start", "end"])
-    matched_span_precision = span_match_precision(on=["start", "end"])
+        # Match reference and candidate spans in both directions at once
+        span_match = Match(reference_df, candidate_df, annotation_layer=annotation_layer, n_jobs=n_jobs, executor=executor)
+        matched_span_recall, matched_span_precision = span_match.bidirectional(on=["start", "end"])
+    # Evaluate at the given lenient level or, with all_levels, at levels 0-3 (column "Lenient")
+    lenient_levels = list(range(4)) if all_levels else [lenient_level]
     span_metrics = MetricsForSpansAnonymisation(
         precision_table=matched_span_precision, recall_table=matched_span_recall
-    )(lenient_level=lenient_level, row_name="Span")
-
-    list_of_span_evaluation.append(span_metrics)
+    )
+    list_of_span_evaluation.append(_span_evaluation(span_metrics, "Span", lenient_level, all_levels))
 
     # Compute span metrics by filtered head value
     if filter_head:
@@ -71,41 +89,83 @@ def evaluate(
             recall_table=matched_span_recall[
                 matched_span_recall[filter_head] == head_value
             ],
-        )(lenient_level=lenient_level, row_name=head_value.capitalize())
-        list_of_span_evaluation.append(filtered_span_metrics)
+        )
+        list_of_span_evaluation.append(
+            _span_evaluation(filtered_span_metrics, head_value.capitalize(), lenient_level, all_levels)
+        )
 
     # Evaluation
+    metric_columns = ["P", "R", "F1", "TP_Precision", "TP_Recall", "FP", "FN", "Support"]
     spans_eval_df = (
-        pd.concat(list_of_span_evaluation)[["P", "R", "F1", "TP_Precision", "TP_Recall", "FP", "FN", "Support"]]
+        pd.concat(list_of_span_evaluation)[(["Lenient"] if all_levels else []) + metric_columns]
         .reset_index()
         .rename(columns={"index": "Span", "support": "Support"})
     )
     spans_eval_df["Label"] = "Span"
     spans_eval_df.rename(columns={"Span": "Level"}, inplace=True)
 
+    # Compute span metrics per value of metadata columns, e.g. per document or domain
+    if group_by:
+        if isinstance(group_by, str):
+            group_by = [group_by]
+        grouped_metrics = MetricsForSpansAnonymisation(
+            precision_table=matched_span_precision, recall_table=matched_span_recall
+        )
+        list_of_group_evaluations = []
+        for column in group_by:
+            for level in lenient_levels:
+                group_metrics = grouped_metrics.by_group(column, lenient_level=level)
+                if all_levels:
+                    group_metrics["Lenient"] = level
+                group_metrics["Level"] = column
+                group_metrics["Label"] = group_metrics.index.astype(str)
+                list_of_group_evaluations.append(group_metrics.reset_index(drop=True))
+        spans_eval_df = pd.concat([spans_eval_df, *list_of_group_evaluations]).reset_index(drop=True)
+
     # Compute metrics for categorical spans
     if categorical_evaluation:
         if not categorical_head:
             raise ValueError(f"Can not filter {categorical_head} by None")
         list_of_categorical_evaluations = []
-        if isinstance(categorical_head, str):
-            categorical_metrics = MetricsForCategoricalSpansAnonymisation(
-                matched_span_precision,
-                matched_span_recall,
-                classification_head=categorical_head,
-            )(lenient_level=lenient_level)
-            list_of_categorical_evaluations.append(categorical_metrics)
-        else:
-            for head in categorical_head:
+        for level in lenient_levels:
+            if isinstance(categorical_head, str):
                 categorical_metrics = MetricsForCategoricalSpansAnonymisation(
                     matched_span_precision,
                     matched_span_recall,
-                    classification_head=head,
-                )(lenient_level=lenient_level)[["P", "R", "F1", "TP_Precision", "TP_Recall", "FP", "FN", "Support"]]
-                categorical_metrics["Level"] =  head
+                    classification_head=categorical_head,
+                )(lenient_level=level)
+                if all_levels:
+                    categorical_metrics["Lenient"] = level
                 list_of_categorical_evaluations.append(categorical_metrics)
+            else:
+                for head in categorical_head:
+                    categorical_metrics = MetricsForCategoricalSpansAnonymisation(
+                        matched_span_precision,
+                        matched_span_recall,
+                        classification_head=head,
+                    )(lenient_level=level)[metric_columns]
+                    if all_levels:
+                        categorical_metrics["Lenient"] = level
+                    categorical_metrics["Level"] = head
+                    list_of_categorical_evaluations.append(categorical_metrics)
         categorical_eval_df = pd.concat(list_of_categorical_evaluations)
         categorical_eval_df["Label"] = categorical_eval_df.index
         categorical_eval_df.reset_index(drop=True, inplace=True)
         spans_eval_df = pd.concat([spans_eval_df, categorical_eval_df]).reset_index(drop=True)
+    if all_levels:
+        # One block of rows per lenient level
+        spans_eval_df = spans_eval_df.sort_values("Lenient", kind="stable").reset_index(drop=True)
     return matched_span_precision, matched_span_recall, spans_eval_df
+
+
+def _span_evaluation(metrics: MetricsForSpansAnonymisation, row_name: str, lenient_level: int = 0, all_levels: bool = False):
+    """
+    Span metrics at a single lenient level or, with all_levels, at levels 0-3 with lenient level in column "Lenient".
+    :param metrics: Span metrics of precision and recall table
+    :param row_name: Row name as index
+    :param lenient_level: Lenient level (ignored with all_levels)
+    :param all_levels: Evaluate all lenient levels from a single count of span statuses
+    """
+    if all_levels:
+        return metrics.all_levels(row_name=row_name).rename_axis("Lenient").reset_index().set_index("row_name").rename_axis(None)
+    return metrics(lenient_level=lenient_level, row_name=row_name)
@@ -0,0 +1,234 @@
+from concurrent.futures import Executor
+
+import numpy as np
+import pandas as pd
+
+from clueval.spans_table.parallel import map_in_pool
+from .metrics import MetricsForCategoricalSpansAnonymisation
+
+
+class BootstrapMetrics:
+    """
+    Percentile bootstrap confidence intervals of P, R and F1 for all lenient levels and categories. Match tables are
+    reduced once to count vectors per resampling unit (document or span); every resample is then a weighted sum of
+    these vectors, with weights drawn in batches from a multinomial distribution.
+    """
+
+    # Status of accepted matches by lowest lenient level; all other statuses are never accepted
+    status_levels = {"exact": 0, "contained": 1, "tiled": 2, "covered": 3}
+    n_levels = 4
+    metric_names = ["P", "R", "F1"]
+
+    def __init__(
+        self,
+        precision_table: pd.DataFrame,
+        recall_table: pd.DataFrame,
+        categorical_head: str | list[str] | None = None,
+        unit: str = "document",
+        suffix: str = "_Y",
+        n_jobs: int = 1,
+        executor: Executor | None = None,
+    ):
+        """
+        :param precision_table: Match table of candidate spans
+        :param recall_table: Match table of reference spans
+        :param categorical_head: Head(s) for categorical metrics
+        :param unit: Resampling unit: "document" (by doc_id, requires at least 2 documents) or "span" (precision and
+                recall spans resampled separately)
+        :param suffix: Suffix of candidate columns
+        :param n_jobs: Number of worker processes for resampling (-1: all CPUs)
+        :param executor: Existing pool to reuse
+        """
+        if unit not in ("document", "span"):
+            raise ValueError(f"Unknown resampling unit {unit}. Use 'document' or 'span'")
+        if isinstance(categorical_head, str):
+            categorical_head = [categorical_head]
+        self.precision_table = precision_table
+        self.recall_table = recall_table
+        self.categorical_head = categorical_head or []
+        self.unit = unit
+        self.n_jobs = n_jobs
+        self.executor = executor
+        self.categorical_metrics = {
+            head: MetricsForCategoricalSpansAnonymisation(precision_table, recall_table, classification_head=head, suffix=suffix)
+            for head in self.categorical_head
+        }
+        # One row for span evaluation and one for every category of every categorical head
+        self.rows = [("Span", "Span")]
+        for head, metrics in self.categorical_metrics.items():
+            self.rows.extend((head, category) for category in metrics.categories)
+
+    def __call__(
+        self,
+        n_resamples: int = 1000,
+        confidence_level: float = 0.95,
+        seed: int | None = None,
+        chunk_size: int | None = None,
+    ):
+        """
+        Compute scores and confidence intervals.
+        :param n_resamples: Number of bootstrap resamples
+        :param confidence_level: Coverage of the percentile intervals
+        :param seed: Seed of the random generator; results depend on seed and chunk_size, but not on n_jobs
+        :param chunk_size: Number of resamples drawn at once (default: bounded by the number of units)
+        :return: Dataframe with one row per lenient level, evaluation level and label
+        """
+        if n_resamples < 1:
+            raise ValueError(f"Number of resamples must be at least 1, not {n_resamples}")
+        if not 0 < confidence_level < 1:
+            raise ValueError(f"Confidence level must be between 0 and 1, not {confidence_level}")
+        unit_counts, strata = self.unit_counts()
+        if self.unit == "document" and unit_counts.shape[0] < 2:
+            raise ValueError(
+                "Resampling documents requires at least 2 documents (convert with doc_id_column), or use unit='span'"
+            )
+        scores = self.scores(unit_counts.sum(axis=0))
+        resampled_scores = self.resample(unit_counts, strata, n_resamples, seed=seed, chunk_size=chunk_size)
+        alpha = (1 - confidence_level) / 2
+        lower, upper = np.percentile(resampled_scores, [100 * alpha, 100 * (1 - alpha)], axis=0)
+
+        columns = {}
+        for i, name in enumerate(self.metric_names):
+            columns[name] = scores[..., i].ravel()
+            columns[f"{name}_lower"] = lower[..., i].ravel()
+            columns[f"{name}_upper"] = upper[..., i].ravel()
+        # Scores are ordered by lenient level, then row
+        index = pd.MultiIndex.from_tuples(
+            [(level, head, label) for level in range(self.n_levels) for head, label in self.rows],
+            names=["Lenient", "Level", "Label"],
+        )
+        ci_df = pd.DataFrame(columns, index=index).round(4).reset_index()
+        ci_df["Label"] = ci_df["Label"].str.capitalize().where(ci_df["Level"] != "Span", "Span")
+        return ci_df
+
+    def unit_counts(self, doc_ids: list | None = None):
+        """
+        Count vectors per resampling unit. Every vector holds, for precision and recall table and for every row,
+        the number of spans accepted at lenient levels 0-3 and the number of all spans.
+        :param doc_ids: Order of documents, e.g. to align units of several systems (default: document_ids())
+        :return: Array of shape (units, 2, rows, 5) and list of unit indices per stratum
+        """
+        if self.unit == "document":
+            doc_ids = self.document_ids() if doc_ids is None else doc_ids
+            units = [pd.Index(doc_ids).get_indexer(table["doc_id"].astype(object)) for table in self.tables]
+            if any((unit < 0).any() for unit in units):
+                raise ValueError("Match tables contain documents that are not in doc_ids")
+            n_units = len(doc_ids)
+            strata = [np.arange(n_units)]
+        else:
+            # Precision spans first, then recall spans
+            n_precision = self.precision_table.shape[0]
+            n_units = n_precision + self.recall_table.shape[0]
+            units = [np.arange(n_precision), np.arange(n_precision, n_units)]
+            strata = [np.arange(n_precision), np.arange(n_precision, n_units)]
+
+        n_rows = len(self.rows)
+        # Counts by lowest accepted lenient level; last bin for spans that are never accepted
+        counts = np.zeros((n_units, 2, n_rows, self.n_levels + 1), dtype=np.int64)
+        for t, (table, unit) in enumerate(zip(self.tables, units)):
+            status_level = self.status_level(table)
+            row_offset = 1
+            np.add.at(counts, (unit, t, 0, status_level), 1)
+            for head, metrics in self.categorical_metrics.items():
+                row = pd.Index(metrics.categories).get_indexer(table[head].astype(object))
+                is_category = row >= 0
+                level = np.where(metrics.same_labels(table).to_numpy(), status_level, self.n_levels)
+                np.add.at(counts, (unit[is_category], t, row_offset + row[is_category], level[is_category]), 1)
+                row_offset += len(metrics.categories)
+
+        unit_counts = np.empty_like(counts)
+        unit_counts[..., : self.n_levels] = counts[..., : self.n_levels].cumsum(axis=-1)
+        unit_counts[..., self.n_levels] = counts.sum(axis=-1)
+        return unit_counts, strata
+
+    def document_ids(self):
+        """Document IDs of precision and recall table in order of appearance."""
+        return pd.concat(
+            [self.precision_table["doc_id"].astype(object), self.recall_table["doc_id"].astype(object)]
+        ).unique().tolist()
+
+    def resample(
+        self,
+        unit_counts: np.ndarray,
+        strata: list[np.ndarray],
+        n_resamples: int,
+        seed: int | None = None,
+        chunk_size: int | None = None,
+    ):
+        """
+        Scores of bootstrap resamples, computed in chunks (optionally in parallel).
+        :param unit_counts: Count vectors per unit
+        :param strata: Unit indices per stratum; every stratum is resampled to its own size
+        :param n_resamples: Number of resamples
+        :param seed: Seed of the random generator
+        :param chunk_size: Number of resamples per chunk
+        :return: Array of shape (n_resamples, levels, rows, 3)
+        """
+        flat_counts = unit_counts.reshape(unit_counts.shape[0], -1)
+        # Units with identical count vectors are interchangeable, so drawing n units with replacement amounts to a
+        # multinomial draw over distinct vectors (few for spans, one per document at most for documents)
+        unit_types = []
+        for stratum in strata:
+            if len(stratum) > 0:
+                type_counts, multiplicity = np.unique(flat_counts[stratum], axis=0, return_counts=True)
+                unit_types.append((type_counts, multiplicity / len(stratum), len(stratum)))
+        n_types = sum(type_counts.shape[0] for type_counts, _, _ in unit_types)
+        chunks = [(unit_types, size, chunk_seed) for size, chunk_seed in self.chunks(n_resamples, n_types, seed, chunk_size)]
+        resampled_counts = map_in_pool(_resample_chunk, chunks, n_jobs=self.n_jobs, executor=self.executor)
+        resampled_counts = np.concatenate(resampled_counts).reshape(n_resamples, *unit_counts.shape[1:])
+        return self.scores(resampled_counts)
+
+    @staticmethod
+    def chunks(n_resamples: int, n_columns: int, seed: int | None = None, chunk_size: int | None = None):
+        """
+        Split resamples into chunks with independent seeds.
+        :param n_resamples: Number of resamples
+        :param n_columns: Number of columns of the weight matrices, i.e. of units drawn from
+        :param seed: Seed of the random generator
+        :param chunk_size: Number of resamples per chunk (default: bounded by n_columns)
+        :return: List of tuples (number of resamples, seed sequence)
+        """
+        if chunk_size is None:
+            # Keep weight matrices at about 4M entries
+            chunk_size = max(1, min(1000, 2 ** 22 // max(1, n_columns)))
+        chunk_sizes = [min(chunk_size, n_resamples - start) for start in range(0, n_resamples, chunk_size)]
+        return list(zip(chunk_sizes, np.random.SeedSequence(seed).spawn(len(chunk_sizes))))
+
+    @classmethod
+    def scores(cls, counts: np.ndarray):
+        """
+        P, R and F1 (in percent) from summed count vectors; scores are 0.0 if denominators are zero.
+        :param counts: Array of shape (..., 2, rows, 5)
+        :return: Array of shape (..., levels, rows, 3)
+        """
+        counts = np.moveaxis(counts.astype(float), -1, -3)
+        tp, n = counts[..., : cls.n_levels, :, :], counts[..., cls.n_levels:, :, :]
+        precision = 100 * np.divide(tp[..., 0, :], n[..., 0, :], out=np.zeros_like(tp[..., 0, :]), where=n[..., 0, :] > 0)
+        recall = 100 * np.divide(tp[..., 1, :], n[..., 1, :], out=np.zeros_like(tp[..., 1, :]), where=n[..., 1, :] > 0)
+        f1 = np.divide(
+            2 * precision * recall, precision + recall, out=np.zeros_like(precision), where=precision + recall > 0
+        )
+        return np.stack([precision, recall, f1], axis=-1)
+
+    @property
+    def tables(self):
+        return self.precision_table, self.recall_table
+
+    def status_level(self, table: pd.DataFrame):
+        """Lowest lenient level at which spans are accepted (n_levels if never)."""
+        return table["status"].astype(object).map(self.status_levels).fillna(self.n_levels).to_numpy(dtype=np.int64)
+
+
+def _resample_chunk(chunk):
+    """
+    Draw a chunk of resamples and sum the count vectors of the drawn units.
+    :param chunk: Tuple (distinct count vectors, their probabilities and the number of units per stratum;
+            number of resamples; seed sequence)
+    """
+    unit_types, size, seed = chunk
+    rng = np.random.default_rng(seed)
+    resampled_counts = 0
+    for type_counts, probabilities, n_units in unit_types:
+        weights = rng.multinomial(n_units, probabilities, size=size)
+        resampled_counts = resampled_counts + weights @ type_counts
+    return resampled_counts
@@ -64,36 +64,91 @@ class MetricsForSpansAnonymisation(Metrics):
         :param row_name: Row name as index
         """
         if 0 <= lenient_level <= 3:
-            # True positive cases for Precision: exact matches and accepted lenient spans
-            tp_precision = self.precision_table[
-                self.precision_table["status"].isin(self.lenient_levels[lenient_level])
-            ].shape[0]
-            # True positive cases for Recall: exact matches and accepted lenient spans
-            tp_recall = self.recall_table[
-                self.recall_table["status"].isin(self.lenient_levels[lenient_level])
-            ].shape[0]
-
-            # Update metrics
-            self.metrics["P"] = self.precision(
-                tp_precision, self.precision_table.shape[0]
-            )
-            self.metrics["R"] = self.recall(tp_recall, self.recall_table.shape[0])
-            self.metrics["F1"] = self.f1(self.metrics["P"], self.metrics["R"])
-            self.metrics["TP_Precision"] = self.precision_table[
-                self.precision_table["status"].isin(self.lenient_levels[lenient_level])
-            ].shape[0]
-            self.metrics["TP_Recall"] = self.recall_table[
-                self.recall_table["status"].isin(self.lenient_levels[lenient_level])
-            ].shape[0]
-            self.metrics["FN"] = self.recall_table.shape[0] - tp_recall
-            self.metrics["FP"] = self.precision_table.shape[0] - tp_precision
-            self.metrics["Support"] = self.recall_table.shape[0]
+            self.metrics.update(self.metrics_for_level(self.status_counts(), lenient_level))
             self.metrics["row_name"] = row_name
         else:
             raise ValueError(
                 f"{lenient_level} is not allowed! Only levels between 0 and 3"
             )
 
+    def all_levels(self, row_name: str = None):
+        """
+        Compute evaluation metrics for all lenient levels from a single count of span statuses per table.
+        :param row_name: Row name
+        :return: Dataframe with one row per lenient level (0-3)
+        """
+        counts = self.status_counts()
+        rows = [{"lenient_level": level, **self.metrics_for_level(counts, level), "row_name": row_name} for level in self.lenient_levels]
+        return pd.DataFrame(rows).set_index("lenient_level")
+
+    def by_group(self, group_by: str, lenient_level: int = 0):
+        """
+        Compute evaluation metrics per value of a metadata column (e.g. doc_id or domain) from a single grouped
+        aggregation per table. Precision counts are grouped by the column of the candidate spans, recall counts by
+        the column of the reference spans. Scores are 0.0 for groups without spans in one of the tables.
+        :param group_by: Column in precision and recall table
+        :param lenient_level: Lenient level
+        :return: Dataframe with one row per group value
+        """
+        if not 0 <= lenient_level <= 3:
+            raise ValueError(f"{lenient_level} is not allowed! Only levels between 0 and 3")
+        counts = []
+        for table in (self.precision_table, self.recall_table):
+            if group_by not in table.columns:
+                raise ValueError(f"Can not group by {group_by}: column not found")
+            is_tp = table["status"].isin(self.lenient_levels[lenient_level])
+            group_counts = is_tp.groupby(table[group_by].astype(object), sort=False).agg(["size", "sum"])
+            group_counts.columns = ["n", "TP"]
+            counts.append(group_counts)
+        precision_counts, recall_counts = counts
+        group_counts = precision_counts.join(recall_counts, how="outer", lsuffix="_Precision", rsuffix="_Recall")
+        group_counts = group_counts.fillna(0).astype(int)
+
+        n_precision, n_recall = group_counts["n_Precision"], group_counts["n_Recall"]
+        tp_precision, tp_recall = group_counts["TP_Precision"], group_counts["TP_Recall"]
+        precision = (100 * tp_precision / n_precision.where(n_precision > 0)).round(4).fillna(0.0)
+        recall = (100 * tp_recall / n_recall.where(n_recall > 0)).round(4).fillna(0.0)
+        f1 = (2 * precision * recall / (precision + recall).where(precision + recall > 0)).round(4).fillna(0.0)
+        return pd.DataFrame(
+            dict(
+                P=precision,
+                R=recall,
+                F1=f1,
+                TP_Precision=tp_precision,
+                TP_Recall=tp_recall,
+                FN=n_recall - tp_recall,
+                FP=n_precision - tp_precision,
+                Support=n_recall,
+            )
+        )
+
+    def status_counts(self):
+        """Number of spans per status in precision and recall table."""
+        return self.precision_table["status"].value_counts(), self.recall_table["status"].value_counts()
+
+    def metrics_for_level(self, counts: tuple[pd.Series, pd.Series], lenient_level: int):
+        """
+        Derive metrics for a lenient level from status counts.
+        :param counts: Number of spans per status in precision and recall table
+        :param lenient_level: Lenient level
+        """
+        precision_counts, recall_counts = counts
+        # True positive cases: exact matches and accepted lenient spans
+        tp_precision = int(precision_counts.reindex(self.lenient_levels[lenient_level], fill_value=0).sum())
+        tp_recall = int(recall_counts.reindex(self.lenient_levels[lenient_level], fill_value=0).sum())
+        precision = self.precision(tp_precision, self.precision_table.shape[0])
+        recall = self.recall(tp_recall, self.recall_table.shape[0])
+        return dict(
+            P=precision,
+            R=recall,
+            F1=self.f1(precision, recall),
+            TP_Precision=tp_precision,
+            TP_Recall=tp_recall,
+            FN=self.recall_table.shape[0] - tp_recall,
+            FP=self.precision_table.shape[0] - tp_precision,
+            Support=self.recall_table.shape[0],
+        )
+
 
 class MetricsForCategoricalSpansAnonymisation(Metrics):
     def __init__(
@@ -144,9 +199,10 @@ class MetricsForCategoricalSpansAnonymisation(Metrics):
         )
 
     def __call__(self, lenient_level=0):
+        counts = self.category_counts(lenient_level)
         categorical_metrics = []
         for cat in self.categories:
-            self.compute_metrics(lenient_level, input_category=cat)
+            self.compute_metrics(lenient_level, input_category=cat, counts=counts)
             categorical_metrics.append(
                 pd.DataFrame(self.metrics, index=[cat.capitalize()]).drop(
                     columns="row_name"
@@ -154,7 +210,7 @@ class MetricsForCategoricalSpansAnonymisation(Metrics):
             )
         return pd.concat(categorical_metrics)
 
-    def compute_metrics(self, lenient_level: int = 0, input_category: str = None):
+    def compute_metrics(self, lenient_level: int = 0, input_category: str = None, counts: tuple[pd.DataFrame, pd.DataFrame] | None = None):
         """
         Method to compute classification metrics for given category.
         Compute evaluation metrics:
@@ -166,31 +222,11 @@ class MetricsForCategoricalSpansAnonymisation(Metrics):
                 - 1: ["exact", "contained"],
                 - 2: ["exact", "contained", "tiled"],
                 - 3: ["exact", "contained", "tiled", "covered"]
+        :param counts: Per-category counts from category_counts() (computed if not given)
         """
-        # Conditions for TP:
-        # 1. Exact match and additional lenient levels
-        # 2. x_head equals input category
-        # 3. x_head == x_head_Y, where x_head is the reference column and x_head_Y is the candidate column
-        tp_precision = self.precision_table[
-            (self.precision_table["status"].isin(self.lenient_levels[lenient_level]))
-            & (self.precision_table[self.classification_head] == input_category)
-            & (
-                self.precision_table[self.classification_head]
-                == self.precision_table[self.classification_head + self.suffix]
-            )
-        ].shape[0]
-        tp_recall = self.recall_table[
-            (self.recall_table["status"].isin(self.lenient_levels[lenient_level]))
-            & (self.recall_table[self.classification_head] == input_category)
-            & (
-                self.recall_table[self.classification_head]
-                == self.recall_table[self.classification_head + self.suffix]
-            )
-        ].shape[0]
-
-        # Total amount of input category as denominator
-        n_category_precision = sum(self.precision_cls_head == input_category)
-        n_category_recall = sum(self.recall_cls_head == input_category)
+        precision_counts, recall_counts = counts if counts is not None else self.category_counts(lenient_level)
+        tp_precision, n_category_precision = precision_counts.loc[input_category, ["TP", "n"]].tolist()
+        tp_recall, n_category_recall = recall_counts.loc[input_category, ["TP", "n"]].tolist()
 
         # Update metrics
         if n_category_precision != 0:
@@ -213,3 +249,46 @@ class MetricsForCategoricalSpansAnonymisation(Metrics):
         self.metrics["FP"] = n_category_precision - tp_precision
         self.metrics["Support"] = n_category_recall
         self.metrics["row_name"] = input_category
+
+    def category_counts(self, lenient_level: int = 0):
+        """
+        Count spans and true positives of every category in a single grouped aggregation per table.
+        Conditions for TP:
+        1. Exact match and additional lenient levels
+        2. x_head == x_head_Y, where x_head is the reference column and x_head_Y is the candidate column
+        :param lenient_level: Lenient level
+        :return: Dataframes with columns n and TP, indexed by category, for precision and recall table
+        """
+        counts = []
+        for table in (self.precision_table, self.recall_table):
+            is_tp = table["status"].isin(self.lenient_levels[lenient_level]) & self.same_labels(table)
+            category_counts = is_tp.groupby(table[self.classification_head], observed=True).agg(["size", "sum"])
+            category_counts.columns = ["n", "TP"]
+            counts.append(category_counts.reindex(self.categories, fill_value=0).astype(int))
+        return tuple(counts)
+
+    def confusion_matrix(self, lenient_level: int = 0):
+        """
+        Confusion matrix of reference (rows) and candidate labels (columns) from a single crosstab. Reference spans
+        without an accepted match are counted in column "FN", candidate spans without an accepted match in row "FP".
+        :param lenient_level: Lenient level
+        """
+        is_matched = self.recall_table["status"].isin(self.lenient_levels[lenient_level])
+        is_spurious = ~self.precision_table["status"].isin(self.lenient_levels[lenient_level])
+        reference = pd.concat([
+            self.recall_table[self.classification_head].astype(object),
+            pd.Series("FP", index=self.precision_table.index[is_spurious], dtype=object),
+        ], ignore_index=True)
+        candidate = pd.concat([
+            self.recall_table[self.classification_head + self.suffix].astype(object).where(is_matched, "FN"),
+            self.precision_table.loc[is_spurious, self.classification_head].astype(object),
+        ], ignore_index=True)
+        return pd.crosstab(reference.rename("reference"), candidate.rename("candidate"))
+
+    def same_labels(self, table: pd.DataFrame):
+        """Compare label columns of x and y, on integer codes if they share categories."""
+        x_labels, y_labels = table[self.classification_head], table[self.classification_head + self.suffix]
+        if isinstance(x_labels.dtype, pd.CategoricalDtype) and x_labels.dtype == y_labels.dtype:
+            x_codes, y_codes = x_labels.cat.codes.to_numpy(), y_labels.cat.codes.to_numpy()
+            return pd.Series((x_codes == y_codes) & (x_codes != -1), index=table.index)
+        return x_labels.astype(object) == y_labels.astype(object)
@@ -0,0 +1,189 @@
+from contextlib import nullcontext
+from concurrent.futures import Executor, ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from clueval.spans_table import Match, Convert
+from clueval.spans_table.parallel import map_in_pool, n_workers
+from .bootstrap import BootstrapMetrics
+
+
+class PairedSignificanceTest:
+    """
+    Paired significance test of the difference in span F1 between two candidates matched against the same reference.
+    Both candidates are reduced once to TP and span counts per document; permutations and resamples are then
+    drawn in batches as weight matrices over these counts. Documents are the unit of the test, since candidate
+    spans of the two systems are not paired, so the match tables need a doc_id column with at least 2 documents.
+    """
+
+    methods = ["permutation", "bootstrap"]
+
+    def __init__(
+        self,
+        precision_table_a: pd.DataFrame,
+        recall_table_a: pd.DataFrame,
+        precision_table_b: pd.DataFrame,
+        recall_table_b: pd.DataFrame,
+        n_jobs: int = 1,
+        executor: Executor | None = None,
+    ):
+        """
+        :param precision_table_a: Match table of spans of candidate A
+        :param recall_table_a: Match table of reference spans against candidate A
+        :param precision_table_b: Match table of spans of candidate B
+        :param recall_table_b: Match table of reference spans against candidate B
+        :param n_jobs: Number of worker processes (-1: all CPUs)
+        :param executor: Existing pool to reuse
+        """
+        self.metrics_a = BootstrapMetrics(precision_table_a, recall_table_a)
+        self.metrics_b = BootstrapMetrics(precision_table_b, recall_table_b)
+        self.n_jobs = n_jobs
+        self.executor = executor
+
+    def __call__(
+        self,
+        method: str = "permutation",
+        n_resamples: int = 10000,
+        seed: int | None = None,
+        chunk_size: int | None = None,
+    ):
+        """
+        Test the null hypothesis that both candidates have the same F1 at every lenient level.
+        - permutation: approximate randomisation, i.e. counts of A and B are swapped per document with probability 0.5
+        - bootstrap: paired bootstrap, i.e. documents are resampled with replacement and the differences are centred
+        P-values are two-sided.
+        :param method: "permutation" or "bootstrap"
+        :param n_resamples: Number of permutations or resamples
+        :param seed: Seed of the random generator
+        :param chunk_size: Number of permutations or resamples drawn at once
+        :return: Dataframe with F1 of both candidates, their difference and p-value per lenient level
+        """
+        if method not in self.methods:
+            raise ValueError(f"Unknown method {method}. Use one of {self.methods}")
+        if n_resamples < 1:
+            raise ValueError(f"Number of resamples must be at least 1, not {n_resamples}")
+        counts_a, counts_b = self.document_counts()
+        n_docs = counts_a.shape[0]
+        if n_docs < 2:
+            raise ValueError("Paired tests require at least 2 documents (convert with doc_id_column)")
+        f1_a, f1_b = self.f1(counts_a.sum(axis=0)), self.f1(counts_b.sum(axis=0))
+        delta = f1_a - f1_b
+
+        chunks = [
+            (method, counts_a.reshape(n_docs, -1), counts_b.reshape(n_docs, -1), size, chunk_seed)
+            for size, chunk_seed in BootstrapMetrics.chunks(n_resamples, n_docs, seed, chunk_size)
+        ]
+        resampled_counts = map_in_pool(_paired_chunk, chunks, n_jobs=self.n_jobs, executor=self.executor)
+        resampled_a = np.concatenate([a for a, _ in resampled_counts]).reshape(n_resamples, *counts_a.shape[1:])
+        resampled_b = np.concatenate([b for _, b in resampled_counts]).reshape(n_resamples, *counts_b.shape[1:])
+        resampled_delta = self.f1(resampled_a) - self.f1(resampled_b)
+
+        if method == "permutation":
+            n_extreme = (np.abs(resampled_delta) >= np.abs(delta) - 1e-9).sum(axis=0)
+        else:
+            n_extreme = (np.abs(resampled_delta - delta) >= np.abs(delta) - 1e-9).sum(axis=0)
+        p_value = (n_extreme + 1) / (n_resamples + 1)
+
+        return pd.DataFrame(
+            {"F1_A": f1_a, "F1_B": f1_b, "Delta": delta, "p_value": p_value},
+            index=pd.RangeIndex(BootstrapMetrics.n_levels, name="Lenient"),
+        ).round(4).reset_index()
+
+    def document_counts(self):
+        """
+        Span counts per document of both candidates, aligned on the union of their documents.
+        :return: Two arrays of shape (documents, 2, 1, 5)
+        """
+        doc_ids = pd.unique(np.array(self.metrics_a.document_ids() + self.metrics_b.document_ids(), dtype=object))
+        counts_a, _ = self.metrics_a.unit_counts(doc_ids=list(doc_ids))
+        counts_b, _ = self.metrics_b.unit_counts(doc_ids=list(doc_ids))
+        return counts_a, counts_b
+
+    @staticmethod
+    def f1(counts: np.ndarray):
+        """F1 per lenient level from summed count vectors of shape (..., 2, 1, 5)."""
+        return BootstrapMetrics.scores(counts)[..., 0, 2]
+
+
+def _paired_chunk(chunk):
+    """
+    Draw a chunk of permutations or resamples and sum the document counts of both candidates.
+    :param chunk: Tuple (method, flat counts of A, flat counts of B, number of draws, seed sequence)
+    """
+    method, counts_a, counts_b, size, seed = chunk
+    rng = np.random.default_rng(seed)
+    n_docs = counts_a.shape[0]
+    if method == "permutation":
+        # Swapping the counts of a document moves its difference from A to B
+        swap = rng.integers(0, 2, size=(size, n_docs))
+        difference = swap @ (counts_b - counts_a)
+        return counts_a.sum(axis=0) + difference, counts_b.sum(axis=0) - difference
+    weights = rng.multinomial(n_docs, np.full(n_docs, 1 / n_docs), size=size)
+    return weights @ counts_a, weights @ counts_b
+
+
+def compare_candidates(
+    path_reference: str,
+    path_candidate_a: str,
+    path_candidate_b: str,
+    annotation_layer: str | list[str],
+    token_id_column: int | None = None,
+    domain_column: int | None = None,
+    doc_id_column: int | None = None,
+    doc_ids: list[str] | None = None,
+    cache_dir: str | None = None,
+    n_jobs: int = 1,
+    method: str = "permutation",
+    n_resamples: int = 10000,
+    seed: int | None = None,
+):
+    """
+    Paired significance test of two candidate files against the same reference file. The reference is converted once,
+    and both candidates are matched against it. Documents are the units of the test, so doc_id_column is required.
+    :param path_reference: Path to reference file
+    :param path_candidate_a: Path to file of candidate A
+    :param path_candidate_b: Path to file of candidate B
+    :param annotation_layer: Names of annotation layers
+    :param token_id_column: Column index of token IDs
+    :param domain_column: Column index of domain
+    :param doc_id_column: Column index of document ID (required; files must contain at least 2 documents)
+    :param doc_ids: Only compare the specified documents
+    :param cache_dir: Cache directory of spans tables
+    :param n_jobs: Number of worker processes (-1: all CPUs)
+    :param method: "permutation" or "bootstrap"
+    :param n_resamples: Number of permutations or resamples
+    :param seed: Seed of the random generator
+    """
+    if not annotation_layer:
+        raise ValueError("No input for annotation_layer")
+    if isinstance(annotation_layer, str):
+        annotation_layer = [annotation_layer]
+    if doc_id_column is None:
+        raise ValueError("Paired tests require documents as units. Specify doc_id_column")
+
+    pool = ProcessPoolExecutor(max_workers=n_workers(n_jobs)) if n_workers(n_jobs) > 1 else nullcontext()
+    with pool as executor:
+        spans_tables = [
+            Convert(
+                path,
+                annotation_layer=annotation_layer,
+                token_id_column=token_id_column,
+                domain_column=domain_column,
+                doc_id_column=doc_id_column,
+                doc_ids=doc_ids,
+                n_jobs=n_jobs,
+                cache_dir=cache_dir,
+                executor=executor,
+            )()
+            for path in (path_reference, path_candidate_a, path_candidate_b)
+        ]
+        reference_df, candidate_dfs = spans_tables[0], spans_tables[1:]
+        match_tables = []
+        for candidate_df in candidate_dfs:
+            span_match = Match(reference_df, candidate_df, annotation_layer=annotation_layer, n_jobs=n_jobs, executor=executor)
+            recall_table, precision_table = span_match.bidirectional(on=["start", "end"])
+            match_tables.extend([precision_table, recall_table])
+        return PairedSignificanceTest(*match_tables, n_jobs=n_jobs, executor=executor)(
+            method=method, n_resamples=n_resamples, seed=seed
+        )
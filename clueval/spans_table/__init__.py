@@ -1,5 +1,5 @@
 from .convert import Convert
 from .match import Match
 from .parser import BioToSentenceParser, BioToSpanParser
-from .data import ParsedSpan, SpanComponent, UnifiedSpan, Token
+from .data import ParsedSpan, SpanComponent, UnifiedSpan, Token, TokenTable, SpanTable, SentenceIndex
 from.unify import OverlapComponentUnifier, MultiHeadSpanTokenUnifier
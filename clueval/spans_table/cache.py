@@ -0,0 +1,129 @@
+import os
+import json
+import pickle
+import hashlib
+import pandas as pd
+
+from clueval.version import __version__
+
+
+class SpansTableCache:
+    """
+    On-disk cache of spans tables. Entries are keyed by the content hash of the input file and the conversion
+    parameters, so they are invalidated automatically if either changes. The cache is bounded in size; least
+    recently used entries are evicted first. Entries are pickled, so the cache directory must not be writable by
+    untrusted users (e.g. when it is shared between CI jobs).
+    """
+
+    suffix = ".pkl"
+    hash_file = "file_hashes.json"
+
+    def __init__(self, cache_dir: str, max_size: int = 2 ** 30):
+        """
+        :param cache_dir: Cache directory (created if it does not exist)
+        :param max_size: Maximum total size of cached tables in bytes
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, path_to_file: str, **parameters):
+        """
+        Cache key from file content and conversion parameters.
+        :param path_to_file: Path to input file
+        :param parameters: Conversion parameters (JSON-serialisable)
+        """
+        description = json.dumps(
+            {"file": self.file_hash(path_to_file), "version": __version__, **parameters}, sort_keys=True
+        )
+        return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """
+        Load cached spans table; returns None if there is no entry for key. Damaged entries are removed.
+        :param key: Cache key
+        """
+        path = os.path.join(self.cache_dir, key + self.suffix)
+        try:
+            spans_df = pd.read_pickle(path)
+        except FileNotFoundError:
+            return None
+        except (EOFError, pickle.UnpicklingError, ValueError, AttributeError):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return None
+        # Mark entry as recently used, unless another process has evicted it in the meantime
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return spans_df
+
+    def put(self, key: str, spans_df: pd.DataFrame):
+        """
+        Store spans table and evict least recently used entries if the cache exceeds its maximum size.
+        :param key: Cache key
+        :param spans_df: Spans table
+        """
+        path = os.path.join(self.cache_dir, key + self.suffix)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        spans_df.to_pickle(tmp_path)
+        os.replace(tmp_path, path)
+        self.evict(keep=path)
+
+    def evict(self, keep: str | None = None):
+        """
+        Remove least recently used entries until the total size is below max_size.
+        :param keep: Path of entry that must not be evicted
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(self.suffix):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    # Removed by another process
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, path))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            if path != keep:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total_size -= size
+
+    def file_hash(self, path_to_file: str):
+        """
+        SHA-256 hash of file content. Hashes are memoised by absolute path, size and modification time,
+        so that unchanged files are not read again.
+        :param path_to_file: Path to file
+        """
+        stat = os.stat(path_to_file)
+        memo_prefix = f"{os.path.abspath(path_to_file)}:"
+        memo_key = f"{memo_prefix}{stat.st_size}:{stat.st_mtime_ns}"
+        memo_path = os.path.join(self.cache_dir, self.hash_file)
+        try:
+            with open(memo_path, "r", encoding="utf-8") as in_f:
+                memo = json.load(in_f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            memo = {}
+        if memo_key not in memo:
+            sha256 = hashlib.sha256()
+            with open(path_to_file, "rb") as in_f:
+                for block in iter(lambda: in_f.read(2 ** 20), b""):
+                    sha256.update(block)
+            # Replace outdated hashes of the same file
+            memo = {key: value for key, value in memo.items() if not key.startswith(memo_prefix)}
+            memo[memo_key] = sha256.hexdigest()
+            tmp_path = f"{memo_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as out_f:
+                json.dump(memo, out_f)
+            os.replace(tmp_path, memo_path)
+        return memo[memo_key]
@@ -1,13 +1,20 @@
+import numpy as np
 import pandas as pd
 from collections import defaultdict
+from concurrent.futures import Executor
 
 from .utils import majority_vote
-from .data import ParsedSpan, Token
+from .data import ParsedSpan, TokenTable
+from .cache import SpansTableCache
+from .parallel import map_in_pool, n_workers
 from .parser import BioToSpanParser
 from .unify import OverlapComponentUnifier, MultiHeadSpanTokenUnifier
 
 
 class Convert:
+    # Compact column types of spans tables
+    dtypes = {"position_start": np.int32, "position_end": np.int32, "doc_id": "category", "domain": "category"}
+
     def __init__(
         self,
         path_to_file: str,
@@ -15,22 +22,48 @@ class Convert:
         token_id_column: int | None = None,
         doc_id_column: int | None = None,
         domain_column: int | None = None,
+        doc_ids: list[str] | None = None,
+        n_jobs: int = 1,
+        cache_dir: str | None = None,
+        executor: Executor | None = None,
     ):
         self.path_to_file = path_to_file
         self.annotation_layer = annotation_layer
         self.token_id_column = token_id_column
         self.doc_id_column = doc_id_column
         self.domain_column = domain_column
+        self.doc_ids = doc_ids
+        self.n_jobs = n_jobs
+        self.executor = executor
+        self.cache = SpansTableCache(cache_dir) if cache_dir is not None else None
         self.annotation_layer_mapping = {str(i): layer for i, layer in enumerate(annotation_layer)}
 
     def __call__(self, id_prefix="id", head: int | None = None):
+        if self.cache is None:
+            return self.convert(id_prefix=id_prefix, head=head)
+
+        # Load spans table from cache or convert and store it
+        key = self.cache.key(
+            self.path_to_file,
+            annotation_layer=self.annotation_layer,
+            token_id_column=self.token_id_column,
+            doc_id_column=self.doc_id_column,
+            domain_column=self.domain_column,
+            doc_ids=self.doc_ids,
+            id_prefix=id_prefix,
+            head=head,
+        )
+        spans_df = self.cache.get(key)
+        if spans_df is None:
+            spans_df = self.convert(id_prefix=id_prefix, head=head)
+            self.cache.put(key, spans_df)
+        return spans_df
+
+    def convert(self, id_prefix="id", head: int | None = None):
         if head is not None:
             spans_df = self.build_head_wise_dataframe(head=head)
         else:
             spans_df = self.build_unified_dataframe()
-            spans_df = spans_df.join(
-                spans_df["label"].apply(pd.Series).add_prefix("head_")
-            ).drop(columns="label")
 
         spans_df.rename(columns={"position_start": "start", "position_end": "end"}, inplace=True)
         spans_df = spans_df.sort_values(by=["start", "end"])
@@ -39,76 +72,94 @@ class Convert:
         return spans_df.reset_index(drop=True)
 
     def build_unified_dataframe(self):
-        doc_to_spans_mapping, doc_to_tokens_mapping, list_of_doc_ids = self.parse()
-        all_unified_spans = []
-        for doc_id in list_of_doc_ids:
-            spans_by_doc_id = doc_to_spans_mapping[doc_id]
-            tokens_by_doc_id = doc_to_tokens_mapping[doc_id]
-
-            # Map overlap components to a unified span
-            component_unifier = OverlapComponentUnifier(spans_by_doc_id)
-            intermediate_overlap_components = component_unifier()
-
-            span_token_unifier = MultiHeadSpanTokenUnifier(
-                intermediate_overlap_components, tokens_by_doc_id
-            )
-            unified_spans = [span for span in span_token_unifier()]
-            all_unified_spans.extend(unified_spans)
-        return pd.DataFrame(all_unified_spans)
+        span_table, token_table = self.parse()
+        component_start, component_end, component_doc_id = OverlapComponentUnifier.component_bounds(span_table)
+        n_chunks = 4 * n_workers(self.n_jobs) if n_workers(self.n_jobs) > 1 else 1
+
+        # Unify components in chunks of consecutive file positions, each with the token table rows it covers
+        by_position = np.argsort(component_start, kind="stable")
+        chunks = []
+        for chunk in np.array_split(by_position, min(n_chunks, max(1, by_position.size))):
+            chunk_start, chunk_end = component_start[chunk], component_end[chunk]
+            if n_chunks > 1 and chunk.size:
+                row_start = np.searchsorted(token_table.position, chunk_start[0])
+                row_end = np.searchsorted(token_table.position, chunk_end.max(), side="right")
+                chunks.append((chunk_start, chunk_end, token_table.slice(row_start, row_end)))
+            else:
+                chunks.append((chunk_start, chunk_end, token_table))
+        results = map_in_pool(
+            _unify_components, chunks, n_jobs=self.n_jobs, executor=self.executor if n_chunks > 1 else None
+        )
+        # Restore order of components by document, start and end
+        restore = np.argsort(by_position)
+        unified_spans = {
+            key: np.concatenate([result[key] for result in results])[restore] if key in ("position_start", "position_end", "label")
+            else np.array([value for result in results for value in result[key]], dtype=object)[restore]
+            for key in results[0]
+        }
+        unified_spans["doc_id"] = np.array(span_table.doc_id_vocabulary, dtype=object)[component_doc_id]
+        unified_spans["domain"] = unified_spans.pop("domain")
+        label_codes = unified_spans.pop("label")
+        spans_df = pd.DataFrame(unified_spans).astype(self.dtypes)
+
+        # Decode label codes into one categorical column per head
+        for head, vocabulary in enumerate(token_table.label_vocabulary):
+            spans_df[f"head_{head}"] = pd.Categorical.from_codes(label_codes[:, head], categories=vocabulary)
+        return spans_df
 
     def build_head_wise_dataframe(self, head: int = 1):
-        doc_to_spans_mapping, doc_to_tokens_mapping, list_of_doc_ids = self.parse()
-        head_spans = []
-        head = head
-        for doc_id in list_of_doc_ids:
-            spans_by_doc_id = doc_to_spans_mapping[doc_id]
-            tokens_by_doc_id = doc_to_tokens_mapping[doc_id]
-            filtered_spans = [span for span in spans_by_doc_id if span.head == head]
-            for span in filtered_spans:
-                span_tokens = [
-                    token
-                    for token in tokens_by_doc_id
-                    if span.start_id <= token.position <= span.end_id
-                ]
-                span_tokens.sort(key=lambda t: t.position)
-                if span_tokens:
-                    text = " ".join([token.token for token in span_tokens])
-                    doc_token_id_start = span_tokens[0].token_id
-                    doc_token_id_end = span_tokens[-1].token_id
-                    # Get Label
-                    labels = [token.label[head] for token in span_tokens]
-                    label = majority_vote(labels)
-                    domain = span_tokens[0].domain
-                else:
-                    text = ""
-                    doc_token_id_start = None
-                    doc_token_id_end = None
-                    label = None
-                    domain = None
-
-                head_spans.append(
-                    {
-                        "doc_id": span.doc_id,
-                        "start_id": span.start_id,
-                        "end_id": span.end_id,
-                        "doc_token_id_start": doc_token_id_start,
-                        "doc_token_id_end": doc_token_id_end,
-                        "text": text,
-                        "label": label,
-                        "domain": domain,
-                    }
-                )
-
-        df = pd.DataFrame(head_spans)
+        span_table, token_table = self.parse()
+        columns = ["doc_id", "start_id", "end_id", "doc_token_id_start", "doc_token_id_end", "text", "label", "domain"]
+        head_spans = {column: [] for column in columns}
+        # Spans by document ID, then corpus position
+        doc_rank = np.argsort(np.argsort(np.array(span_table.doc_id_vocabulary, dtype=object)))
+        head_rows = np.flatnonzero(span_table.head == head)
+        head_rows = head_rows[np.argsort(doc_rank[span_table.doc_id[head_rows]], kind="stable")]
+        # Map document codes of spans to those of tokens
+        token_doc_id_codes = {doc_id: code for code, doc_id in enumerate(token_table.doc_id_vocabulary)}
+        token_doc_id = np.array([token_doc_id_codes.get(doc_id, -1) for doc_id in span_table.doc_id_vocabulary], dtype=np.int32)
+        for i in head_rows:
+            position_start, position_end = int(span_table.position_start[i]), int(span_table.position_end[i])
+            # Slice rows of the span directly from the position-sorted token table
+            row_start = np.searchsorted(token_table.position, position_start)
+            row_end = np.searchsorted(token_table.position, position_end, side="right")
+            span_rows = np.arange(row_start, row_end)
+            span_rows = span_rows[token_table.doc_id[span_rows] == token_doc_id[span_table.doc_id[i]]]
+            if span_rows.size:
+                text = " ".join([token_table.token[row] for row in span_rows])
+                doc_token_id_start = token_table.token_id[span_rows[0]]
+                doc_token_id_end = token_table.token_id[span_rows[-1]]
+                # Get Label
+                label = token_table.label_vocabulary[head - 1][majority_vote(token_table.label[span_rows, head - 1])]
+                domain = token_table.domain_vocabulary[token_table.domain[span_rows[0]]]
+            else:
+                text = ""
+                doc_token_id_start = None
+                doc_token_id_end = None
+                label = None
+                domain = None
+
+            for column, value in zip(columns, [span_table.doc_id_vocabulary[span_table.doc_id[i]], position_start, position_end,
+                                               doc_token_id_start, doc_token_id_end, text, label, domain]):
+                head_spans[column].append(value)
+
+        df = pd.DataFrame(head_spans).astype(
+            {"start_id": np.int32, "end_id": np.int32, "doc_id": "category", "domain": "category"}
+        )
+        df["label"] = pd.Categorical(df["label"], categories=token_table.label_vocabulary[head - 1])
         # Rename columns for consistency with build_unified_dataframe()
+        df = df.rename(columns={"start_id": "start", "end_id": "end"})
         if not df.empty:
-            df = df.rename(columns={"start_id": "start", "end_id": "end"})
             df = df.sort_values(by=["start", "end"]).reset_index(drop=True)
             df = self._assign_span_ids(df, prefix=f"head{head}_")
 
         return df
 
     def parse(self):
+        """
+        Parse spans of all tag columns and tokens in a single pass.
+        :return: SpanTable and TokenTable
+        """
         if not self.annotation_layer:
             raise ValueError("No input for annotation_layer")
         if type(self.annotation_layer) == str:
@@ -116,36 +167,19 @@ class Convert:
         else:
             n_tag_columns = len(self.annotation_layer)
 
-        # Convert BIO to spans
-        parser = BioToSpanParser(self.path_to_file)
-        list_of_spans, list_of_tokens = parser(
-            tag_column=1,
-            n_tag_columns=n_tag_columns,
+        # Convert BIO to spans for all tag columns in a single pass
+        parser = BioToSpanParser(self.path_to_file, doc_ids=self.doc_ids, n_jobs=self.n_jobs, executor=self.executor)
+        return parser(
+            tag_column=list(range(1, n_tag_columns + 1)),
             token_id_column=self.token_id_column,
             doc_id_column=self.doc_id_column,
             domain_column=self.domain_column,
             extract_tokens=True,
+            compact=True,
         )
 
-        if isinstance(self.annotation_layer, list):
-            for i in range(1, len(self.annotation_layer)):
-                spans_per_layer, _ = parser(
-                    tag_column=i + 1,
-                    token_id_column=self.token_id_column,
-                    doc_id_column=self.doc_id_column,
-                    domain_column=self.domain_column,
-                    extract_tokens=False,
-                )
-                list_of_spans.extend(spans_per_layer)
-
-        #  Partition spans and Token objects by doc_id
-        doc_ids = sorted(list(set(token.doc_id for token in list_of_tokens)))
-        doc_to_spans_dict = self.doc_to_object_mapping(list_of_spans)
-        doc_to_tokens_dict = self.doc_to_object_mapping(list_of_tokens)
-        return doc_to_spans_dict, doc_to_tokens_dict, doc_ids
-
     @staticmethod
-    def doc_to_object_mapping(list_of_object: list[ParsedSpan | Token]):
+    def doc_to_object_mapping(list_of_object: list[ParsedSpan]):
         """
 
         :param list_of_object:
@@ -163,5 +197,16 @@ class Convert:
         :param inp_data: Pandas dataframe with extracted spans
         :param prefix: IDs prefix
         """
-        inp_data["id"] = [f"{prefix}{i + 1:06d}" for i in range(inp_data.shape[0])]
+        numbers = np.char.zfill(np.arange(1, inp_data.shape[0] + 1).astype(str), 6)
+        inp_data["id"] = np.char.add(prefix, numbers).astype(object)
         return inp_data
+
+
+def _unify_components(chunk: tuple[np.ndarray, np.ndarray, TokenTable]):
+    """
+    Map overlap components to unified spans (worker function for process pools).
+    :param chunk: Start and end positions of components and the token table covering them
+    :return: Columns of unified spans as returned by MultiHeadSpanTokenUnifier.unify_positions()
+    """
+    position_start, position_end, token_table = chunk
+    return MultiHeadSpanTokenUnifier.unify_positions(position_start, position_end, token_table)
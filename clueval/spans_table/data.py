@@ -1,19 +1,22 @@
+import numpy as np
+
+from array import array
 from dataclasses import dataclass
 
 
-@dataclass
+@dataclass(slots=True)
 class UnifiedSpan:
     position_start: int
     position_end: int
     token_id_start: int
     token_id_end: int
     text: str
-    label: str | list[str]
+    label: int | list[int]
     doc_id: str
     domain: str
 
 
-@dataclass
+@dataclass(slots=True)
 class ParsedSpan:
     position_start: int
     position_end: int
@@ -21,14 +24,14 @@ class ParsedSpan:
     head: int | str
 
 
-@dataclass
+@dataclass(slots=True)
 class SpanComponent:
     position_start: int
     position_end: int
     doc_id: str | int
 
 
-@dataclass
+@dataclass(slots=True)
 class Token:
     position: int
     token_id: int | str | None
@@ -36,3 +39,379 @@ class Token:
     label: str | list[str]
     doc_id: str | None
     domain: str | None
+
+
+class LabelVocabulary:
+    """
+    Interned BIO tags of a single annotation layer. Each distinct tag is parsed exactly once into its BIO prefix
+    and the integer code of its label.
+    """
+
+    def __init__(self):
+        self.labels: list[str] = []
+        self.label_codes: dict[str, int] = {}
+        self.tags: dict[str, tuple[str, int]] = {}
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, code: int):
+        return self.labels[code]
+
+    def lookup(self, tag: str):
+        """
+        Map BIO tag to its prefix ('B', 'I' or '' for tags without prefix such as 'O') and its label code.
+        :param tag: BIO tag
+        """
+        try:
+            return self.tags[tag]
+        except KeyError:
+            if tag.startswith(("B-", "I-")):
+                prefix, label = tag[0], tag[2:]
+            else:
+                prefix, label = "", tag
+            if label not in self.label_codes:
+                self.label_codes[label] = len(self.labels)
+                self.labels.append(label)
+            self.tags[tag] = (prefix, self.label_codes[label])
+            return self.tags[tag]
+
+
+class PackedStrings:
+    """
+    Compact storage of many short strings in a single UTF-8 buffer.
+    Strings are separated by a single whitespace, so that consecutive strings can be decoded as joined text at once.
+    """
+
+    def __init__(self, buffer: bytes, offsets: np.ndarray):
+        self.buffer = buffer
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int):
+        return self.buffer[self.offsets[index]:self.offsets[index + 1] - 1].decode("utf-8")
+
+    @classmethod
+    def concatenate(cls, packed_strings: list["PackedStrings"]):
+        offsets, base = [np.zeros(1, dtype=np.int64)], 0
+        for strings in packed_strings:
+            offsets.append(strings.offsets[1:] + base)
+            base += len(strings.buffer)
+        return cls(b"".join(strings.buffer for strings in packed_strings), np.concatenate(offsets))
+
+    def slice(self, start: int, end: int):
+        """
+        Strings from index start to end (exclusive) as new PackedStrings.
+        :param start: Index of first string
+        :param end: Index after last string
+        """
+        offsets = self.offsets[start:end + 1]
+        return PackedStrings(self.buffer[offsets[0]:offsets[-1]], offsets - offsets[0])
+
+    def join(self, start: int, end: int):
+        """
+        Decode strings from index start to end (inclusive) joined by whitespace.
+        :param start: Index of first string
+        :param end: Index of last string
+        """
+        return self.buffer[self.offsets[start]:self.offsets[end + 1] - 1].decode("utf-8")
+
+
+@dataclass
+class TokenTable:
+    """
+    Columnar store of all tokens of a corpus. Document IDs, domains and labels (one column per head) are stored
+    as integer codes into the corresponding vocabularies.
+    """
+    position: np.ndarray
+    token: PackedStrings
+    token_id: PackedStrings
+    label: np.ndarray
+    label_vocabulary: list[list[str]]
+    doc_id: np.ndarray
+    doc_id_vocabulary: list[str]
+    domain: np.ndarray
+    domain_vocabulary: list[str]
+
+    def __len__(self):
+        return self.position.shape[0]
+
+    @classmethod
+    def concatenate(cls, tables: list["TokenTable"]):
+        """
+        Concatenate tables in corpus order. Codes are mapped to joint vocabularies in order of first occurrence,
+        so the result is the same as a table built from all tokens at once.
+        :param tables: List of TokenTables with the same number of heads
+        """
+        label_vocabulary, label = [], []
+        for head in range(tables[0].n_heads):
+            vocabulary, mappings = cls._joint_vocabulary([table.label_vocabulary[head] for table in tables])
+            label_vocabulary.append(vocabulary)
+            label.append(np.concatenate([mapping[table.label[:, head]] for mapping, table in zip(mappings, tables)]))
+        doc_id_vocabulary, doc_id_mappings = cls._joint_vocabulary([table.doc_id_vocabulary for table in tables])
+        domain_vocabulary, domain_mappings = cls._joint_vocabulary([table.domain_vocabulary for table in tables])
+        return cls(
+            position=np.concatenate([table.position for table in tables]),
+            token=PackedStrings.concatenate([table.token for table in tables]),
+            token_id=PackedStrings.concatenate([table.token_id for table in tables]),
+            label=np.stack(label, axis=1),
+            label_vocabulary=label_vocabulary,
+            doc_id=np.concatenate([mapping[table.doc_id] for mapping, table in zip(doc_id_mappings, tables)]),
+            doc_id_vocabulary=doc_id_vocabulary,
+            domain=np.concatenate([mapping[table.domain] for mapping, table in zip(domain_mappings, tables)]),
+            domain_vocabulary=domain_vocabulary,
+        )
+
+    @staticmethod
+    def _joint_vocabulary(vocabularies: list[list[str]]):
+        """
+        Join vocabularies in order of first occurrence.
+        :return: Joint vocabulary and one array per vocabulary that maps its codes to joint codes
+        """
+        codes = {}
+        mappings = [np.array([codes.setdefault(value, len(codes)) for value in vocabulary], dtype=np.int32) for vocabulary in vocabularies]
+        return list(codes), mappings
+
+    @property
+    def n_heads(self):
+        return self.label.shape[1]
+
+    def row(self, position: int):
+        """Map corpus position to row index."""
+        return int(np.searchsorted(self.position, position))
+
+    def slice(self, start: int, end: int):
+        """
+        Rows from start to end (exclusive) as new TokenTable with the same vocabularies.
+        :param start: Index of first row
+        :param end: Index after last row
+        """
+        return TokenTable(
+            position=self.position[start:end],
+            token=self.token.slice(start, end),
+            token_id=self.token_id.slice(start, end),
+            label=self.label[start:end],
+            label_vocabulary=self.label_vocabulary,
+            doc_id=self.doc_id[start:end],
+            doc_id_vocabulary=self.doc_id_vocabulary,
+            domain=self.domain[start:end],
+            domain_vocabulary=self.domain_vocabulary,
+        )
+
+    def labels_of(self, index: int):
+        """Decode labels of token at row index; single label as string, multiple labels as list."""
+        labels = [self.label_vocabulary[head][code] for head, code in enumerate(self.label[index])]
+        return labels[0] if self.n_heads == 1 else labels
+
+    def to_tokens(self):
+        """Generate Token objects from table rows."""
+        for i in range(len(self)):
+            yield Token(
+                position=int(self.position[i]),
+                token_id=self.token_id[i],
+                token=self.token[i],
+                label=self.labels_of(i),
+                doc_id=self.doc_id_vocabulary[self.doc_id[i]],
+                domain=self.domain_vocabulary[self.domain[i]],
+            )
+
+
+class TokenTableBuilder:
+    """Collect tokens row by row in compact buffers and build a TokenTable."""
+
+    def __init__(self, label_vocabularies: list[LabelVocabulary]):
+        self.label_vocabularies = label_vocabularies
+        self.n_heads = len(label_vocabularies)
+        self.position = array("q")
+        self.token = bytearray()
+        self.token_offsets = array("q", [0])
+        self.token_id = bytearray()
+        self.token_id_offsets = array("q", [0])
+        self.label = array("i")
+        self.doc_id = array("i")
+        self.doc_id_codes = {}
+        self.domain = array("i")
+        self.domain_codes = {}
+
+    def __len__(self):
+        return len(self.doc_id)
+
+    def append(self, position: int, token: str, token_id: str, labels: list[int], doc_id: str, domain: str):
+        """
+        Append a token as new row.
+        :param position: Corpus position
+        :param token: Token string
+        :param token_id: Predefined token ID
+        :param labels: One label code per head
+        :param doc_id: Document ID
+        :param domain: Text domain
+        """
+        self.position.append(position)
+        self.token += token.encode("utf-8") + b" "
+        self.token_offsets.append(len(self.token))
+        self.token_id += str(token_id).encode("utf-8") + b" "
+        self.token_id_offsets.append(len(self.token_id))
+        self.label.extend(labels)
+        self.doc_id.append(self.doc_id_codes.setdefault(doc_id, len(self.doc_id_codes)))
+        self.domain.append(self.domain_codes.setdefault(domain, len(self.domain_codes)))
+
+    def build(self):
+        return TokenTable(
+            position=np.frombuffer(self.position, dtype=np.int64),
+            token=PackedStrings(bytes(self.token), np.frombuffer(self.token_offsets, dtype=np.int64)),
+            token_id=PackedStrings(bytes(self.token_id), np.frombuffer(self.token_id_offsets, dtype=np.int64)),
+            label=np.frombuffer(self.label, dtype=np.int32).reshape(-1, self.n_heads),
+            label_vocabulary=[vocabulary.labels for vocabulary in self.label_vocabularies],
+            doc_id=np.frombuffer(self.doc_id, dtype=np.int32),
+            doc_id_vocabulary=list(self.doc_id_codes),
+            domain=np.frombuffer(self.domain, dtype=np.int32),
+            domain_vocabulary=list(self.domain_codes),
+        )
+
+
+@dataclass
+class SpanTable:
+    """
+    Columnar store of parsed spans, grouped by head. Document IDs are stored as integer codes into doc_id_vocabulary.
+    """
+    position_start: np.ndarray
+    position_end: np.ndarray
+    head: np.ndarray
+    doc_id: np.ndarray
+    doc_id_vocabulary: list[str]
+
+    def __len__(self):
+        return self.position_start.shape[0]
+
+    @classmethod
+    def concatenate(cls, tables: list["SpanTable"]):
+        """
+        Concatenate tables; document codes are mapped to a joint vocabulary in order of first occurrence.
+        :param tables: List of SpanTables
+        """
+        doc_id_vocabulary, doc_id_mappings = TokenTable._joint_vocabulary([table.doc_id_vocabulary for table in tables])
+        return cls(
+            position_start=np.concatenate([table.position_start for table in tables]),
+            position_end=np.concatenate([table.position_end for table in tables]),
+            head=np.concatenate([table.head for table in tables]),
+            doc_id=np.concatenate([mapping[table.doc_id] for mapping, table in zip(doc_id_mappings, tables)]),
+            doc_id_vocabulary=doc_id_vocabulary,
+        )
+
+    def take(self, indices: np.ndarray):
+        """
+        Rows at the given indices (or boolean mask) as new SpanTable with the same vocabulary.
+        :param indices: Row indices or boolean mask
+        """
+        return SpanTable(
+            position_start=self.position_start[indices],
+            position_end=self.position_end[indices],
+            head=self.head[indices],
+            doc_id=self.doc_id[indices],
+            doc_id_vocabulary=self.doc_id_vocabulary,
+        )
+
+    def to_spans(self):
+        """Generate ParsedSpan objects from table rows."""
+        for start, end, head, doc_id in zip(
+            self.position_start.tolist(), self.position_end.tolist(), self.head.tolist(), self.doc_id.tolist()
+        ):
+            yield ParsedSpan(position_start=start, position_end=end, doc_id=self.doc_id_vocabulary[doc_id], head=head)
+
+
+class SpanTableBuilder:
+    """Collect spans of several heads in compact buffers and build a SpanTable grouped by head."""
+
+    def __init__(self, heads: list[int]):
+        self.heads = heads
+        self.position_start = {head: array("q") for head in heads}
+        self.position_end = {head: array("q") for head in heads}
+        self.doc_id = {head: array("i") for head in heads}
+        self.doc_id_codes = {}
+
+    def append(self, head: int, position_start: int, position_end: int, doc_id: str):
+        """
+        Append a span of the given head.
+        :param head: Head (tag column)
+        :param position_start: Corpus position of first token
+        :param position_end: Corpus position of last token
+        :param doc_id: Document ID
+        """
+        self.position_start[head].append(position_start)
+        self.position_end[head].append(position_end)
+        self.doc_id[head].append(self.doc_id_codes.setdefault(doc_id, len(self.doc_id_codes)))
+
+    def build(self):
+        return SpanTable(
+            position_start=np.concatenate([np.frombuffer(self.position_start[head], dtype=np.int64) for head in self.heads]),
+            position_end=np.concatenate([np.frombuffer(self.position_end[head], dtype=np.int64) for head in self.heads]),
+            head=np.repeat(np.array(self.heads, dtype=np.int32), [len(self.position_start[head]) for head in self.heads]),
+            doc_id=np.concatenate([np.frombuffer(self.doc_id[head], dtype=np.int32) for head in self.heads]),
+            doc_id_vocabulary=list(self.doc_id_codes),
+        )
+
+
+@dataclass
+class SentenceIndex:
+    """
+    Sentences of a corpus as offsets into flat arrays of corpus positions and tokens.
+    Sentence i consists of the tokens offsets[i] to offsets[i + 1] - 1 of the flat arrays.
+    """
+    offsets: np.ndarray
+    positions: np.ndarray
+    tokens: PackedStrings
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1
+
+    @classmethod
+    def from_sentences(cls, sentences):
+        """
+        Build index from an iterable of sentences.
+        :param sentences: Iterable of tuples (list of corpus positions, list of tokens)
+        """
+        offsets = array("q", [0])
+        positions = array("q")
+        buffer = bytearray()
+        token_offsets = array("q", [0])
+        for token_ids, sent in sentences:
+            positions.extend(token_ids)
+            for token in sent:
+                buffer += token.encode("utf-8") + b" "
+                token_offsets.append(len(buffer))
+            offsets.append(len(positions))
+        return cls(
+            offsets=np.frombuffer(offsets, dtype=np.int64),
+            positions=np.frombuffer(positions, dtype=np.int64),
+            tokens=PackedStrings(bytes(buffer), np.frombuffer(token_offsets, dtype=np.int64)),
+        )
+
+    @classmethod
+    def from_mapping(cls, mapping: dict):
+        """
+        Build index from the output of BioToSentenceParser, i.e. dict(token_ids=[...], sents=[...]).
+        :param mapping: Dictionary with lists of corpus positions and lists of tokens per sentence
+        """
+        return cls.from_sentences(zip(mapping["token_ids"], mapping["sents"]))
+
+    def sentence_of(self, position: int):
+        """
+        Find the sentence that contains the given corpus position; returns None if there is none.
+        :param position: Corpus position
+        """
+        row = int(np.searchsorted(self.positions, position))
+        if row == self.positions.shape[0] or self.positions[row] != position:
+            return None
+        # Empty sentences share their offset with the following sentence, so take the last matching one
+        return int(np.searchsorted(self.offsets, row, side="right")) - 1
+
+    def sentence(self, index: int):
+        """
+        Corpus positions and tokens of a sentence.
+        :param index: Sentence index
+        :return: Array of corpus positions and list of tokens
+        """
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.positions[start:end], [self.tokens[i] for i in range(start, end)]
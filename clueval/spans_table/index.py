@@ -0,0 +1,196 @@
+import os
+import mmap
+import zipfile
+import numpy as np
+
+
+def read_mapped_lines(path: str, start: int = 0, end: int | None = None):
+    """
+    Memory-map a file and yield its lines between the byte offsets start and end together with their offsets.
+    :param path: Path to file
+    :param start: Byte offset of first line
+    :param end: Byte offset after last line (default: end of file)
+    """
+    if os.stat(path).st_size == 0:
+        return
+    with open(path, "rb") as in_f, mmap.mmap(in_f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        end = mm.size() if end is None else end
+        mm.seek(start)
+        offset = start
+        while offset < end:
+            line = mm.readline()
+            yield offset, line
+            offset += len(line)
+
+
+class VrtIndex:
+    """
+    Byte-offset index of a VRT file. Records for every document (i.e. every change of the value in doc_id_column)
+    and for every sentence (i.e. lines following a blank line) the byte offset of its first line together with
+    the corpus position of its first token, so that parsers can seek directly to a document.
+    """
+
+    suffix = ".index.npz"
+
+    def __init__(
+        self,
+        path: str,
+        doc_id_column: int | None,
+        file_size: int,
+        file_mtime: int,
+        doc_ids: list[str],
+        doc_offsets: np.ndarray,
+        doc_positions: np.ndarray,
+        doc_line_counts: np.ndarray,
+        sentence_offsets: np.ndarray,
+        sentence_positions: np.ndarray,
+    ):
+        self.path = path
+        self.doc_id_column = doc_id_column
+        self.file_size = file_size
+        self.file_mtime = file_mtime
+        # One entry per document and an additional entry for the end of file
+        self.doc_ids = doc_ids
+        self.doc_offsets = doc_offsets
+        self.doc_positions = doc_positions
+        self.doc_line_counts = doc_line_counts
+        # One entry per sentence
+        self.sentence_offsets = sentence_offsets
+        self.sentence_positions = sentence_positions
+
+    @classmethod
+    def load_or_build(cls, path: str, doc_id_column: int | None = None):
+        """
+        Load index persisted next to the VRT file. The index is rebuilt and saved if it does not exist or is outdated,
+        i.e. if the file has changed or a different doc_id_column is requested.
+        :param path: Path to VRT file
+        :param doc_id_column: Column index of document ID
+        """
+        index_path = path + cls.suffix
+        stat = os.stat(path)
+        if os.path.exists(index_path):
+            try:
+                index = cls.load(path)
+            except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+                # Damaged index, e.g. written by an interrupted process; rebuild it
+                index = None
+            if index is not None and (index.file_size, index.file_mtime, index.doc_id_column) == (stat.st_size, stat.st_mtime_ns, doc_id_column):
+                return index
+        index = cls.build(path, doc_id_column=doc_id_column)
+        try:
+            index.save()
+        except OSError:
+            # Index can still be used without being persisted, e.g. in read-only directories
+            pass
+        return index
+
+    @classmethod
+    def build(cls, path: str, doc_id_column: int | None = None):
+        """
+        Build index by scanning the memory-mapped VRT file once.
+        :param path: Path to VRT file
+        :param doc_id_column: Column index of document ID
+        """
+        stat = os.stat(path)
+        doc_ids, doc_offsets, doc_positions, doc_line_counts = [], [], [], []
+        sentence_offsets, sentence_positions = [], []
+        position = 0
+        line_count = 0
+        current_doc_id = None
+        new_sentence = True
+
+        for offset, line in read_mapped_lines(path):
+            current_line = line.strip().split(b"\t")
+            if len(current_line) > 1:
+                if new_sentence:
+                    sentence_offsets.append(offset)
+                    sentence_positions.append(position)
+                    new_sentence = False
+                if doc_id_column is not None:
+                    doc_id = current_line[doc_id_column].decode("utf-8")
+                    if doc_id != current_doc_id:
+                        doc_ids.append(doc_id)
+                        doc_offsets.append(offset)
+                        doc_positions.append(position)
+                        doc_line_counts.append(line_count)
+                        current_doc_id = doc_id
+                position += 1
+            else:
+                new_sentence = True
+            if current_line != [b""]:
+                line_count += 1
+
+        doc_offsets.append(stat.st_size)
+        doc_positions.append(position)
+        doc_line_counts.append(line_count)
+        return cls(
+            path=path,
+            doc_id_column=doc_id_column,
+            file_size=stat.st_size,
+            file_mtime=stat.st_mtime_ns,
+            doc_ids=doc_ids,
+            doc_offsets=np.array(doc_offsets, dtype=np.int64),
+            doc_positions=np.array(doc_positions, dtype=np.int64),
+            doc_line_counts=np.array(doc_line_counts, dtype=np.int64),
+            sentence_offsets=np.array(sentence_offsets, dtype=np.int64),
+            sentence_positions=np.array(sentence_positions, dtype=np.int64),
+        )
+
+    @classmethod
+    def load(cls, path: str):
+        # Open the file first, so that it is closed even if np.load fails on a damaged index
+        with open(path + cls.suffix, "rb") as in_f, np.load(in_f) as index:
+            return cls(
+                path=path,
+                doc_id_column=None if index["doc_id_column"] < 0 else int(index["doc_id_column"]),
+                file_size=int(index["file_size"]),
+                file_mtime=int(index["file_mtime"]),
+                doc_ids=index["doc_ids"].tolist(),
+                doc_offsets=index["doc_offsets"],
+                doc_positions=index["doc_positions"],
+                doc_line_counts=index["doc_line_counts"],
+                sentence_offsets=index["sentence_offsets"],
+                sentence_positions=index["sentence_positions"],
+            )
+
+    def save(self):
+        """Save index next to the VRT file. The file is replaced atomically, so concurrent readers never see a partial index."""
+        index_path = self.path + self.suffix
+        tmp_path = f"{index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as out_f:
+            np.savez(
+                out_f,
+                doc_id_column=-1 if self.doc_id_column is None else self.doc_id_column,
+                file_size=self.file_size,
+                file_mtime=self.file_mtime,
+                doc_ids=np.array(self.doc_ids, dtype=str),
+                doc_offsets=self.doc_offsets,
+                doc_positions=self.doc_positions,
+                doc_line_counts=self.doc_line_counts,
+                sentence_offsets=self.sentence_offsets,
+                sentence_positions=self.sentence_positions,
+            )
+        os.replace(tmp_path, index_path)
+
+    def document_ranges(self, doc_ids: list[str]):
+        """
+        Byte ranges of the given documents in file order. Documents that occur in several runs yield several ranges.
+        :param doc_ids: Document IDs
+        :return: List of tuples (start offset, end offset, corpus position of first token, number of preceding non-empty lines)
+        """
+        if self.doc_id_column is None:
+            raise ValueError("Index has no document information. Build index with doc_id_column")
+        missing = set(doc_ids).difference(self.doc_ids)
+        if missing:
+            raise KeyError(f"Documents not found in {self.path}: {sorted(missing)}")
+        selected = set(doc_ids)
+        return [
+            (
+                int(self.doc_offsets[i]),
+                int(self.doc_offsets[i + 1]),
+                int(self.doc_positions[i]),
+                int(self.doc_line_counts[i]),
+            )
+            for i, doc_id in enumerate(self.doc_ids)
+            if doc_id in selected
+        ]
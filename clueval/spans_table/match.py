@@ -3,48 +3,195 @@ warnings.simplefilter(action="ignore", category=FutureWarning)  # Suppress panda
 import pandas as pd
 import numpy as np
 
+from concurrent.futures import Executor
+from functools import partial
+
+from .parallel import map_in_pool, n_workers
+
 
 class Match:
-    def __init__(self, x: pd.DataFrame, y: pd.DataFrame, annotation_layer: str | list[str]):
-        self.x = x
-        self.y = y
+    # Categories are sorted, so that match tables sort by status as if it were a string column
+    status_dtype = pd.CategoricalDtype(sorted(["exact", "contained", "tiled", "covered", "unmatched"]))
+
+    def __init__(
+        self,
+        x: pd.DataFrame,
+        y: pd.DataFrame,
+        annotation_layer: str | list[str],
+        n_jobs: int = 1,
+        executor: Executor | None = None,
+    ):
+        """
+        :param x: Spans table
+        :param y: Spans table
+        :param annotation_layer: Label columns
+        :param n_jobs: Number of processes for matching groups of documents in parallel (-1: all CPUs)
+        :param executor: Existing process pool to use if n_jobs > 1
+        """
         self.annotation_layer = annotation_layer if isinstance(annotation_layer, list) else [annotation_layer]
+        self.x, self.y = self.align_label_categories(x, y, self.annotation_layer)
+        self.n_jobs = n_jobs
+        self.executor = executor
 
     def __call__(self, on: str | list[str]):
-        exact = self.exact_match(self.x, self.y, on=on)
-        rest = self.rest_match(exact)
-        match_df = pd.concat([exact, rest], ignore_index=True).sort_values(by=["start", "end"])
-        match_df.loc[match_df["status"] == "exact", ["start_Y", "end_Y"]] = match_df.loc[match_df["status"] == "exact"][["start", "end"]].values
+        results = self.match_partitions(on=on)
+        return self.finalize(self.concat(results))
+
+    def bidirectional(self, on: str | list[str]):
+        """ Match x in y and y in x in a single pass, sharing exact matches and remaining spans between both
+        directions. Equivalent to (Match(x, y)(on), Match(y, x)(on)), e.g. recall and precision table.
+        :param on: Columns for exact matches
+        :return: Match table of x and match table of y
+        """
+        results = self.match_partitions(on=on, bidirectional=True)
+        return (self.finalize(self.concat([x_match for x_match, _ in results])),
+                self.finalize(self.concat([y_match for _, y_match in results])))
+
+    def match_partitions(self, on: str | list[str], bidirectional: bool = False):
+        """ Match groups of documents, in a process pool if n_jobs > 1.
+        :param on: Columns for exact matches
+        :param bidirectional: Match in both directions
+        :return: List of raw match tables (or tuples of raw match tables) per group
+        """
+        n_partitions = 4 * n_workers(self.n_jobs) if n_workers(self.n_jobs) > 1 else 1
+        partitions = self.partition(n_partitions)
+        match_partition = partial(_match_partition, annotation_layer=self.annotation_layer, on=on, bidirectional=bidirectional)
+        return map_in_pool(match_partition, partitions, n_jobs=self.n_jobs, executor=self.executor if n_partitions > 1 else None)
+
+    def finalize(self, match_df: pd.DataFrame):
+        """ Sort raw match table, fill in columns of missing matches and convert columns to compact types.
+        :param match_df: Raw match table
+        """
+        match_df = match_df.sort_values(by=["start", "end"], ignore_index=True)
+        is_exact = (match_df["status"] == "exact").to_numpy()
+        match_df.loc[is_exact, ["start_Y", "end_Y"]] = match_df.loc[is_exact, ["start", "end"]].values
         match_df.drop(columns=["id",
                                "id_y",
                                "id_Y",
                                "doc_id_Y",
                                "domain_Y"
                                ], inplace=True)
-        # Fill Nan values in label columns with "FN"
+        # Fill Nan values in label columns with "FN"; labels of y share the (aligned) categories of x
         for column in self.annotation_layer:
-            match_df.fillna({column + "_Y": "FN"}, inplace=True)
+            labels = match_df[column + "_Y"].fillna("FN")
+            if isinstance(match_df[column].dtype, pd.CategoricalDtype):
+                labels = labels.astype(match_df[column].dtype)
+            match_df[column + "_Y"] = labels
         match_df.loc[match_df["status"] == "unmatched", ["token_id_start_Y", "token_id_end_Y", "text_Y"]] = ""
-        match_df.loc[match_df[["start_Y", "end_Y"]].isna().any(axis=1), ["start_Y", "end_Y"]] = -100
-        match_df[["start_Y", "end_Y"]] = match_df[["start_Y", "end_Y"]].astype("Int64")
-        return match_df.reset_index(drop=True)
+        match_df["start_Y"] = match_df["start_Y"].astype("Int64").fillna(-100).astype(np.int32)
+        match_df["end_Y"] = match_df["end_Y"].astype("Int64").fillna(-100).astype(np.int32)
+        match_df["status"] = match_df["status"].astype(self.status_dtype)
+        return match_df
+
+    @staticmethod
+    def concat(match_dfs: list[pd.DataFrame]):
+        """ Concatenate raw match tables of several groups, skipping empty groups. Columns that only occur in
+        skipped tables are kept (empty).
+        """
+        non_empty = [match_df for match_df in match_dfs if not match_df.empty]
+        columns = list(dict.fromkeys(column for match_df in match_dfs for column in match_df.columns))
+        return pd.concat(non_empty or match_dfs[:1], ignore_index=True).reindex(columns=columns)
+
+    def match(self, on: str | list[str]):
+        """ Exact and remaining matches of x in y without post-processing.
+        :param on: Columns for exact matches
+        """
+        exact = self.exact_match(self.x, self.y, on=on)
+        rest = self.rest_match(exact)
+        return self.concat([exact, rest])
+
+    def match_both(self, on: str | list[str]):
+        """ Exact and remaining matches of x in y and of y in x without post-processing. The exact matches of y
+        are obtained from those of x by swapping columns.
+        :param on: Columns for exact matches
+        """
+        exact = self.exact_match(self.x, self.y, on=on)
+        x_rest, y_rest = self.rest_tables(exact)
+        x_match = self.concat([exact, self.classify(x_rest, y_rest)])
+        y_match = self.concat([self.swap_exact_match(exact, on=on), self.classify(y_rest, x_rest)])
+        return x_match, y_match
+
+    def partition(self, n_partitions: int):
+        """ Split x and y into groups of whole documents, which can be matched independently as spans never
+        cross document boundaries.
+        :param n_partitions: Maximum number of groups
+        :return: List of (x, y) tuples
+        """
+        if n_partitions == 1 or "doc_id" not in self.x.columns or "doc_id" not in self.y.columns:
+            return [(self.x, self.y)]
+        doc_ids = pd.concat([self.x["doc_id"].astype(object), self.y["doc_id"].astype(object)]).drop_duplicates().sort_values().to_numpy()
+        partitions = []
+        for doc_ids_of_partition in np.array_split(doc_ids, min(n_partitions, max(1, doc_ids.shape[0]))):
+            partitions.append((
+                self.x.loc[self.x["doc_id"].isin(doc_ids_of_partition)],
+                self.y.loc[self.y["doc_id"].isin(doc_ids_of_partition)],
+            ))
+        return partitions
+
+    @staticmethod
+    def align_label_categories(x: pd.DataFrame, y: pd.DataFrame, annotation_layer: list[str]):
+        """ Share label categories between x and y, so that label codes are comparable across both tables.
+        The category "FN" is added for missing matches.
+        :param x: Spans table
+        :param y: Spans table
+        :param annotation_layer: Label columns
+        :return: x and y with aligned categorical label columns
+        """
+        x_dtypes, y_dtypes = {}, {}
+        for column in annotation_layer:
+            if isinstance(x[column].dtype, pd.CategoricalDtype) or isinstance(y[column].dtype, pd.CategoricalDtype):
+                categories = pd.Index(x[column].astype("category").cat.categories)
+                categories = categories.append(pd.Index(y[column].astype("category").cat.categories).difference(categories))
+                if "FN" not in categories:
+                    categories = categories.append(pd.Index(["FN"]))
+                x_dtypes[column] = y_dtypes[column] = pd.CategoricalDtype(categories)
+        if x_dtypes:
+            x = x.astype(x_dtypes)
+            y = y.astype(y_dtypes)
+        return x, y
 
     @staticmethod
     def exact_match(x: pd.DataFrame, y: pd.DataFrame, on: str | list[str]):
         """ x.s0 == y.s1 & x.e0 == y.e1 """
         return x.merge(y, on=on, suffixes=("", "_Y"), how="inner").assign(status="exact")
 
+    def swap_exact_match(self, exact_df: pd.DataFrame, on: str | list[str]):
+        """ Turn exact matches of x in y into exact matches of y in x, as if computed by exact_match(y, x).
+        :param exact_df: Exact matches of x in y
+        :param on: Columns for exact matches
+        """
+        on = on if isinstance(on, list) else [on]
+        if set(self.x.columns) != set(self.y.columns):
+            # Suffixes only apply to shared columns, so compute the merge instead
+            return self.exact_match(self.y, self.x, on=on)
+        swapped = {column: column + "_Y" for column in self.x.columns if column not in on}
+        swapped.update({column + "_Y": column for column in self.x.columns if column not in on})
+        columns = list(self.y.columns) + [column + "_Y" for column in self.x.columns if column not in on] + ["status"]
+        return exact_df.rename(columns=swapped)[columns]
+
+    def rest_tables(self, exact_df: pd.DataFrame):
+        """ Temporarily remove exact matches from x and y. The remaining rows get status "rest" and an empty
+        id_y column for the IDs of matched spans, so that they can be classified in either direction.
+        :param exact_df: Exact matches of x in y
+        :return: Remaining rows of x and y
+        """
+        x_rest = self.x.loc[~self.x["id"].isin(exact_df["id"])].assign(status="rest", id_y="")
+        y_rest = self.y.loc[~self.y["id"].isin(exact_df["id_Y"])].assign(status="rest", id_y="")
+        return x_rest, y_rest
+
     def rest_match(self, exact_df: pd.DataFrame):
         """
         :param exact_df:
         :return:
         """
-        # Temporarily remove exact matches from x and y
-        x_rest = self.x.loc[~self.x["id"].isin(exact_df["id"])].reset_index(drop=True).assign(status="rest")
-        x_rest = x_rest.assign(id_y="")
-        y_rest = self.y.loc[~self.y["id"].isin(exact_df["id_Y"])].reset_index(drop=True).assign(status="rest")
-        y_rest = y_rest.assign(id_x="")
+        x_rest, y_rest = self.rest_tables(exact_df)
+        return self.classify(x_rest, y_rest)
 
+    def classify(self, x_rest: pd.DataFrame, y_rest: pd.DataFrame):
+        """ Assign status to remaining rows of x.
+        :param x_rest: Remaining rows of x
+        :param y_rest: Remaining rows of y
+        """
         # Case 2: x is contained in y [original jargon: "x is a subset of y"]
         x_rest = self.contained(x_rest, y_rest)
 
@@ -60,83 +207,104 @@ class Match:
     def contained(self, x: pd.DataFrame, y: pd.DataFrame):
         """ Remaining rows after omitting exact matches:
         y.s1 <= x.s0 & y.e1 >= x.e0
+        Spans in y do not overlap, so only the last y span starting at or before x can contain x. It is found
+        for all rows at once by binary search over the sorted start positions of y.
         """
         y_columns = ["start_Y", "end_Y", "token_id_start_Y", "token_id_end_Y", "text_Y"] + [col + "_Y" for col in self.annotation_layer]
         x[y_columns] = None
-        for i, row in x.iterrows():
-            superset_y = y[(y["start"] <= row["start"]) & (y["end"] >= row["end"])]
-            if not superset_y.empty:
-                matched_id = superset_y.id.values[0]
-                x.at[i, "id_y"] = matched_id
-                x.at[i, "status"] = "contained"
-                x.loc[i, y_columns] = superset_y.loc[:, [column.strip("_Y") for column in y_columns]].iloc[0].values
+        if x.empty or y.empty:
+            return x
+        order = np.argsort(y["start"].to_numpy(), kind="stable")
+        y_start, y_end = y["start"].to_numpy()[order], y["end"].to_numpy()[order]
+        candidates = np.searchsorted(y_start, x["start"].to_numpy(), side="right") - 1
+        is_contained = (candidates >= 0) & (y_end[np.maximum(candidates, 0)] >= x["end"].to_numpy())
+        rows = order[candidates[is_contained]]
+
+        x.loc[is_contained, "id_y"] = y["id"].to_numpy()[rows]
+        x.loc[is_contained, "status"] = "contained"
+        for column in y_columns:
+            x.loc[is_contained, column] = y[column.removesuffix("_Y")].to_numpy()[rows]
         return x
 
     def overlap(self, x: pd.DataFrame, y: pd.DataFrame):
         """ Consider overlap cases, where x could be covered by y spans in two different ways:
         1. tiled: x has the same start and end positions as adjacent spans in y
         2. covered: x is covered by longer adjacent spans in y
-        :param x: Rest x dataframe
+        As spans in y do not overlap, the spans overlapping x form a contiguous range of the sorted y table. These
+        ranges and their adjacency are determined for all rows at once.
+        :param x: Rest x dataframe (modified in place)
         :param y: Rest y dataframe
         :return:
         """
-        _x = x.copy()
         y_columns = ["start_Y", "end_Y", "token_id_start_Y", "token_id_end_Y", "text_Y"] + [col + "_Y" for col in self.annotation_layer]
-        for i, row in _x.iterrows():
-            if row["status"] == "rest":
-                overlap = y[~((row["end"] < y["start"]) | (y["end"] < row["start"]))]
-                overlap = overlap.sort_values(by=["start", "end"])
-                if not overlap.empty:
-                    adjacent = True
-                    for j in range(overlap.shape[0] - 1):
-                        if overlap.iloc[j]["end"] + 1 != overlap.iloc[j+1]["start"]:
-                            adjacent = False
-                    if adjacent:
-                        # Flag adjacency and generate adjacency dataframe for overlap
-                        overlap["adjacent"] = 1
-                        overlap["number_overlapping_tokens_with_x"] = overlap.apply(
-                            lambda r: len([token for token in r["text"].split() if token in row["text"].split()]), axis=1
-                        )
-                        overlap["id_x"] = row["id"]
-                        adjacent_overlap = overlap.groupby("adjacent").apply(self.unify_adjacent_spans, headers_column=self.annotation_layer)
-                        _x.at[i, "id_y"] = adjacent_overlap["id"]
-                        # Insert spans information from overlap to _x
-                        _x.loc[i, y_columns] = adjacent_overlap.loc[:, [column.strip("_Y") for column in y_columns]].iloc[0].values
-                        # Check whether x.s1 == y.s0 && x.e0 == y.e1 (tiled) or y.s1 <= x.s0 && y.e1 >= x.e0 (covered [originally: "overlap"])
-                        if adjacent_overlap["start"].item() == row["start"] and adjacent_overlap["end"].item() == row["end"]:
-                            _x.at[i, "status"] = "tiled"
-                        elif adjacent_overlap["start"].item() <= row["start"] and adjacent_overlap["end"].item() >= row["end"]:
-                            _x.at[i, "status"] = "covered"
-                    else:
-                        # Assign 'unmatched' to status in _x
-                        _x.at[i, "status"] = "unmatched"
-        return _x
+        is_rest = (x["status"] == "rest").to_numpy()
+        if not is_rest.any() or y.empty:
+            return x
+        y = y.iloc[np.lexsort((y["end"].to_numpy(), y["start"].to_numpy()))]
+        y_start, y_end = y["start"].to_numpy(), y["end"].to_numpy()
+        x_start, x_end = x["start"].to_numpy(), x["end"].to_numpy()
 
-    @staticmethod
-    def unify_adjacent_spans(adjacent_df, headers_column):
-        """ Combine spans information from adjacent dataframe.
-        :param adjacent_df: Grouped dataframe with adjacent span information
-        :param headers_column: Prediction head columns
-        :return:
-        """
-        # Select id from span with based on the total number of tokens (longest span)
-        combined_spans = {"start": adjacent_df["start"].iloc[0],
-                          "end": adjacent_df["end"].iloc[-1],
-                          "token_id_start": adjacent_df["token_id_start"].iloc[0],
-                          "token_id_end": adjacent_df["token_id_end"].iloc[-1],
-                          "doc_id": adjacent_df["doc_id"].iloc[0],
-                          "domain": adjacent_df["domain"].iloc[0],
-                          "text": " | ".join(adjacent_df["text"]),
-                          "id": " | ".join(adjacent_df["id"]),
-                          "status": adjacent_df["status"].iloc[0],
-                          "id_x": " | ".join(adjacent_df["id_x"])
-                          }
-        try:
-            # Select label according to number of overlapping tokens
-            longest_overlap = adjacent_df.loc[adjacent_df["number_overlapping_tokens_with_x"].idxmax()]
-        except KeyError:
-            longest_overlap = adjacent_df
-
-        for column in headers_column:
-            combined_spans[column] = longest_overlap[column]
-        return pd.Series(combined_spans)
+        # Range [first, last) of spans in y overlapping x
+        first = np.searchsorted(y_end, x_start, side="left")
+        last = np.searchsorted(y_start, x_end, side="right")
+        has_overlap = is_rest & (first < last)
+        # Spans in the range are adjacent if there is no gap between consecutive spans
+        n_gaps = np.zeros(y_start.shape[0], dtype=np.int64)
+        n_gaps[1:] = np.cumsum(y_end[:-1] + 1 != y_start[1:])
+        is_adjacent = has_overlap & (n_gaps[np.maximum(last - 1, 0)] == n_gaps[np.minimum(first, y_start.shape[0] - 1)])
+        # Assign 'unmatched' to status in x if overlapping spans are not adjacent
+        x.loc[has_overlap & ~is_adjacent, "status"] = "unmatched"
+
+        rows = np.flatnonzero(is_adjacent)
+        first, last = first[rows], last[rows]
+        # Unify adjacent spans; labels are taken from the span with the most tokens shared with x (the first one
+        # in case of ties), i.e. the longest intersection of positions
+        n_pieces = last - first
+        piece_rows = np.repeat(rows, n_pieces)
+        pieces = np.arange(n_pieces.sum()) + np.repeat(first - np.cumsum(n_pieces) + n_pieces, n_pieces)
+        number_overlapping_tokens_with_x = (
+            np.minimum(y_end[pieces], x_end[piece_rows]) - np.maximum(y_start[pieces], x_start[piece_rows]) + 1
+        )
+        order = np.lexsort((pieces, -number_overlapping_tokens_with_x, piece_rows))
+        longest_overlap = pieces[order[np.cumsum(n_pieces) - n_pieces]]
+        y_text, y_id = y["text"].to_numpy(), y["id"].to_numpy()
+        combined_text = [" | ".join(y_text[j:k]) for j, k in zip(first, last)]
+        combined_id = [" | ".join(y_id[j:k]) for j, k in zip(first, last)]
+
+        combined_spans = {
+            "start_Y": y_start[first],
+            "end_Y": y_end[last - 1],
+            "token_id_start_Y": y["token_id_start"].to_numpy()[first],
+            "token_id_end_Y": y["token_id_end"].to_numpy()[last - 1],
+            "text_Y": combined_text,
+        }
+        for column in self.annotation_layer:
+            combined_spans[column + "_Y"] = y[column].to_numpy()[longest_overlap]
+        x.loc[is_adjacent, "id_y"] = combined_id
+        for column in y_columns:
+            x.loc[is_adjacent, column] = combined_spans[column]
+
+        # Check whether x.s1 == y.s0 && x.e0 == y.e1 (tiled) or y.s1 <= x.s0 && y.e1 >= x.e0 (covered [originally: "overlap"])
+        is_tiled = (combined_spans["start_Y"] == x_start[rows]) & (combined_spans["end_Y"] == x_end[rows])
+        is_covered = ~is_tiled & (combined_spans["start_Y"] <= x_start[rows]) & (combined_spans["end_Y"] >= x_end[rows])
+        x.loc[x.index[rows[is_tiled]], "status"] = "tiled"
+        x.loc[x.index[rows[is_covered]], "status"] = "covered"
+        return x
+
+
+def _match_partition(
+    partition: tuple[pd.DataFrame, pd.DataFrame],
+    annotation_layer: list[str],
+    on: str | list[str],
+    bidirectional: bool = False,
+):
+    """
+    Match a group of documents (worker function for process pools).
+    :param partition: Spans tables x and y of the group
+    :param annotation_layer: Label columns
+    :param on: Columns for exact matches
+    :param bidirectional: Match in both directions
+    """
+    x, y = partition
+    match = Match(x, y, annotation_layer=annotation_layer)
+    return match.match_both(on=on) if bidirectional else match.match(on=on)
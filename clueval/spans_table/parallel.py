@@ -0,0 +1,31 @@
+import os
+
+from concurrent.futures import Executor, ProcessPoolExecutor
+
+
+def n_workers(n_jobs: int | None = 1):
+    """
+    Number of worker processes for n_jobs; -1 (or None) uses all CPUs.
+    :param n_jobs: Number of jobs
+    """
+    if n_jobs is None or n_jobs < 0:
+        return os.cpu_count() or 1
+    return max(1, n_jobs)
+
+
+def map_in_pool(function, items: list, n_jobs: int | None = 1, executor: Executor | None = None, chunksize: int = 1):
+    """
+    Apply function to all items, in a process pool if n_jobs > 1 or an executor is given. Results are returned
+    in the order of the input items.
+    :param function: Picklable (module-level) function
+    :param items: List of arguments
+    :param n_jobs: Number of worker processes (ignored if executor is given)
+    :param executor: Existing pool to reuse
+    :param chunksize: Number of items sent to a worker at once
+    """
+    if executor is not None:
+        return list(executor.map(function, items, chunksize=chunksize))
+    if n_workers(n_jobs) == 1 or len(items) <= 1:
+        return [function(item) for item in items]
+    with ProcessPoolExecutor(max_workers=n_workers(n_jobs)) as pool:
+        return list(pool.map(function, items, chunksize=chunksize))
@@ -1,54 +1,143 @@
 import re
-from .data import ParsedSpan, Token
+import numpy as np
+
+from concurrent.futures import Executor
+from functools import partial
+
+from .data import LabelVocabulary, ParsedSpan, SentenceIndex, SpanTable, SpanTableBuilder, Token, TokenTable, TokenTableBuilder
+from .index import VrtIndex, read_mapped_lines
+from .parallel import map_in_pool, n_workers
+
+
+def stream_lines_with_lookahead(path: str, start: int = 0, end: int | None = None):
+    """
+    Stream a VRT file line by line without reading it into memory.
+    Each line is split into its columns exactly once and yielded together with the next (already split) line,
+    which is an empty list for the last line of the file (or of the byte range).
+    :param path: Path to VRT file
+    :param start: Byte offset to start reading from
+    :param end: Byte offset to stop reading at (default: end of file)
+    """
+    current_line = None
+    for line in _read_lines(path, start=start, end=end):
+        next_line = line.strip().split("\t")
+        if current_line is not None:
+            yield current_line, next_line
+        current_line = next_line
+    if current_line is not None:
+        yield current_line, []
+
+
+def _read_lines(path: str, start: int = 0, end: int | None = None):
+    if start == 0 and end is None:
+        with open(path, "r", encoding="utf-8") as in_f:
+            yield from in_f
+    else:
+        # Seek directly to byte range in memory-mapped file
+        for _, line in read_mapped_lines(path, start=start, end=end):
+            yield line.decode("utf-8")
 
 
 class BioToSentenceParser:
-    def __init__(self, path):
+    def __init__(self, path, doc_ids: list[str] | None = None, doc_id_column: int | None = None):
         self.path = path
         self.token_id = 0
+        self.doc_ids = doc_ids
+        self.doc_id_column = doc_id_column
         
-    def __call__(self):
+    def __call__(self, compact: bool = False):
+        """
+        :param compact: Return a SentenceIndex instead of lists of corpus positions and tokens per sentence
+        """
         sents = dict(token_ids=[], sents=[])
-        with open(self.path, "r", encoding="utf-8") as infile:
-            readfile = infile.readlines()
-            for token_ids, sent in self._generate(readfile):
-                sents["token_ids"].append(token_ids)
-                sents["sents"].append(sent)
+        if self.doc_ids is None:
+            sentences = self._generate(stream_lines_with_lookahead(self.path))
+        else:
+            sentences = self._generate_documents()
+        if compact:
+            return SentenceIndex.from_sentences(sentences)
+        for token_ids, sent in sentences:
+            sents["token_ids"].append(token_ids)
+            sents["sents"].append(sent)
         return sents
+
+    def _generate_documents(self):
+        """Generate sentences of selected documents only by seeking to their byte ranges."""
+        if self.doc_id_column is None:
+            raise ValueError("Selecting documents requires doc_id_column")
+        index = VrtIndex.load_or_build(self.path, doc_id_column=self.doc_id_column)
+        for start, end, _, line_count in index.document_ranges(self.doc_ids):
+            self.token_id = line_count
+            yield from self._generate(stream_lines_with_lookahead(self.path, start=start, end=end), drop_last_line=end == index.file_size)
         
-    def _generate(self, readfile):
+    def _generate(self, lines, drop_last_line: bool = True):
         sent, token_ids = [], []
-        for i, line in enumerate(readfile):
-            if i != len(readfile) - 1:
-                if line.strip() != "":
-                    token = line.split("\t")[0]
+        for line, next_line in lines:
+            if next_line or not drop_last_line:
+                if line != [""]:
+                    token = line[0]
                     sent.append(token)
                     token_ids.append(self.token_id)
                     self.token_id += 1
                 else:
                     yield token_ids, sent
                     token_ids, sent = [], []
-            else:
+            if not next_line and (drop_last_line or sent):
                 yield token_ids, sent
                 token_ids, sent = [], []
 
 class BioToSpanParser:
     """Convert BIO into spans."""
 
-    def __init__(self, path_to_file):
+    def __init__(
+        self,
+        path_to_file,
+        doc_ids: list[str] | None = None,
+        n_jobs: int = 1,
+        byte_ranges: list[tuple[int, int, int]] | None = None,
+        executor: Executor | None = None,
+    ):
+        """
+        :param path_to_file: Path to BIO file
+        :param doc_ids: Only parse the given documents
+        :param n_jobs: Number of processes for parsing all tag columns in a single pass (-1: all CPUs)
+        :param byte_ranges: Only parse the given byte ranges (start offset, end offset, corpus position of first token)
+        :param executor: Existing process pool to use if n_jobs > 1
+        """
         self.path_to_file: str = path_to_file
+        self.doc_ids = doc_ids
+        self.n_jobs = n_jobs
+        self.executor = executor
+        self._byte_ranges = byte_ranges
 
     def __call__(
         self,
-        tag_column: int = 1,
+        tag_column: int | list[int] = 1,
         n_tag_columns: int = 1,
         token_id_column: int | None = None,
         doc_id_column: int | None = None,
         domain_column: int | None = None,
         extract_tokens: bool | None = False,
+        compact: bool = False,
     ):
+        """
+        :param compact: Return spans of a list of tag columns as SpanTable instead of a list of ParsedSpan objects
+        """
         spans = []
         tokens = []
+        # Extract spans for all tag columns (and tokens) in a single pass
+        if isinstance(tag_column, list):
+            span_table, tokens = self.extract_spans_and_tokens_from_iob(
+                tag_columns=tag_column,
+                token_id_column=token_id_column,
+                doc_id_column=doc_id_column,
+                domain_column=domain_column,
+            )
+            spans = span_table if compact else list(span_table.to_spans())
+            if not extract_tokens:
+                tokens = []
+            return spans, tokens
+
         # Extract spans from BIO
         for span in self.extract_spans_from_iob(
             tag_column=tag_column,
@@ -68,6 +157,170 @@ class BioToSpanParser:
 
         return spans, tokens
 
+    def byte_ranges(self, doc_id_column: int | None = None):
+        """
+        Byte ranges to parse: the whole file or, if doc_ids are given, the ranges of the selected documents
+        (using the VRT index).
+        :param doc_id_column: Column index of document ID
+        :return: List of tuples (start offset, end offset, corpus position of first token)
+        """
+        if self._byte_ranges is not None:
+            return self._byte_ranges
+        if self.doc_ids is None:
+            return [(0, None, 0)]
+        if doc_id_column is None:
+            raise ValueError("Selecting documents requires doc_id_column")
+        index = VrtIndex.load_or_build(self.path_to_file, doc_id_column=doc_id_column)
+        return [(start, end, position) for start, end, position, _ in index.document_ranges(self.doc_ids)]
+
+    def split_byte_ranges(self, n_chunks: int, doc_id_column: int | None = None):
+        """
+        Split byte ranges into about n_chunks chunks of similar size. Chunks start at the first token of a sentence,
+        i.e. after a blank (or single-column) line, which closes all open spans. Parsing the chunks separately
+        therefore yields the same spans as parsing the ranges at once.
+        :param n_chunks: Number of chunks
+        :param doc_id_column: Column index of document ID
+        """
+        index = VrtIndex.load_or_build(self.path_to_file, doc_id_column=doc_id_column)
+        chunks = []
+        for start, end, position in self.byte_ranges(doc_id_column=doc_id_column):
+            end = index.file_size if end is None else end
+            # Candidate split points: sentence starts within the range
+            first = np.searchsorted(index.sentence_offsets, start, side="right")
+            last = np.searchsorted(index.sentence_offsets, end, side="left")
+            offsets = index.sentence_offsets[first:last]
+            positions = index.sentence_positions[first:last]
+            boundaries = np.linspace(start, end, n_chunks + 1)[1:-1]
+            selected = np.unique(np.searchsorted(offsets, boundaries))
+            selected = selected[selected < offsets.shape[0]]
+            chunk_starts = [(start, position)] + [(int(offsets[i]), int(positions[i])) for i in selected]
+            chunk_ends = [chunk_start for chunk_start, _ in chunk_starts[1:]] + [end]
+            chunks.extend(
+                (chunk_start, chunk_end, chunk_position)
+                for (chunk_start, chunk_position), chunk_end in zip(chunk_starts, chunk_ends)
+            )
+        return chunks
+
+    def stream(self, doc_id_column: int | None = None):
+        """
+        Stream lines with lookahead from all byte ranges (see byte_ranges()).
+        :param doc_id_column: Column index of document ID
+        :return: Generator of current line, next line and the corpus position of the current line if it starts a
+        new byte range (otherwise None)
+        """
+        for start, end, position in self.byte_ranges(doc_id_column=doc_id_column):
+            range_position = position
+            for current_line, next_line in stream_lines_with_lookahead(self.path_to_file, start=start, end=end):
+                yield current_line, next_line, range_position
+                range_position = None
+
+    def extract_spans_and_tokens_from_iob(
+        self,
+        tag_columns: list[int],
+        token_id_column: int | None = None,
+        doc_id_column: int | None = None,
+        domain_column: int | None = None,
+    ):
+        """
+        Extract spans for every tag column and the token stream in a single pass over the BIO file.
+        Span boundaries follow the same rules as in extract_spans_from_iob(), tokens carry one label per tag column.
+        :param tag_columns: Indices of the tag columns
+        :param token_id_column:
+        :param doc_id_column:
+        :param domain_column:
+        :return: SpanTable (grouped by tag column) and TokenTable
+        """
+        if n_workers(self.n_jobs) > 1:
+            return self._extract_spans_and_tokens_in_parallel(
+                tag_columns=tag_columns,
+                token_id_column=token_id_column,
+                doc_id_column=doc_id_column,
+                domain_column=domain_column,
+            )
+
+        spans = SpanTableBuilder(heads=tag_columns)
+        start_positions = {tag_column: 0 for tag_column in tag_columns}
+        # Label code of the currently open span per tag column (-1: no open span)
+        open_labels = {tag_column: -1 for tag_column in tag_columns}
+        vocabularies = {tag_column: LabelVocabulary() for tag_column in tag_columns}
+        tokens = TokenTableBuilder(label_vocabularies=list(vocabularies.values()))
+
+        position = 0
+        token_id = ""
+        doc_id = ""
+        current_doc_id = ""
+        domain = ""
+
+        for current_line, next_line, range_position in self.stream(doc_id_column=doc_id_column):
+            if range_position is not None:
+                position = range_position
+            if len(current_line) <= 1:
+                continue
+
+            if doc_id_column is not None:
+                doc_id = current_line[doc_id_column]
+            else:
+                doc_id = ""
+            if doc_id != "" and doc_id != current_doc_id:
+                current_doc_id = doc_id
+            if token_id_column:
+                token_id = current_line[token_id_column]
+            if domain_column is not None:
+                domain = current_line[domain_column].lower()
+
+            # Extract spans for each tag column
+            label_codes = []
+            for tag_column in tag_columns:
+                vocabulary = vocabularies[tag_column]
+                current_tag = current_line[tag_column]
+                _, label_code = vocabulary.lookup(current_tag)
+                label_codes.append(label_code)
+                if current_tag == "O":
+                    continue
+                if open_labels[tag_column] == -1:
+                    # Begin of current span
+                    start_positions[tag_column] = position
+                    open_labels[tag_column] = label_code
+                # Generate current span if next tag is 'O', if new span starts with 'B-' or if new entity tag
+                if len(next_line) > 1:
+                    next_prefix, next_label_code = vocabulary.lookup(next_line[tag_column])
+                if (
+                    len(next_line) <= 1
+                    or next_prefix == "B"
+                    or next_label_code != open_labels[tag_column]
+                ):
+                    spans.append(tag_column, start_positions[tag_column], position, current_doc_id)
+                    open_labels[tag_column] = -1
+
+            # Extract token with one label code per tag column
+            tokens.append(
+                position=position,
+                token=current_line[0],
+                token_id=token_id,
+                labels=label_codes,
+                doc_id=doc_id,
+                domain=domain,
+            )
+            position += 1
+
+        return spans.build(), tokens.build()
+
+    def _extract_spans_and_tokens_in_parallel(self, tag_columns: list[int], **columns):
+        """
+        Split file at sentence boundaries, parse chunks in a process pool and stitch results together.
+        Workers return columnar tables, so results are sent back as a few numpy arrays per chunk.
+        """
+        chunks = self.split_byte_ranges(4 * n_workers(self.n_jobs), doc_id_column=columns["doc_id_column"])
+        parse_chunk = partial(_parse_byte_range, self.path_to_file, tag_columns=tag_columns, **columns)
+        results = map_in_pool(parse_chunk, chunks, n_jobs=self.n_jobs, executor=self.executor)
+        spans = SpanTable.concatenate([chunk_spans for chunk_spans, _ in results])
+        tokens = TokenTable.concatenate([chunk_tokens for _, chunk_tokens in results])
+        # Restore order of spans as in the serial parser: grouped by tag column, then by corpus position
+        head_rank = np.zeros(len(spans), dtype=np.int64)
+        for rank, tag_column in enumerate(tag_columns):
+            head_rank[spans.head == tag_column] = rank
+        return spans.take(np.argsort(head_rank, kind="stable")), tokens
+
     def extract_tokens_from_iob(
         self,
         n_tag_columns=1,
@@ -82,44 +335,43 @@ class BioToSpanParser:
         :param doc_id_column:
         """
 
-        with open(self.path_to_file, "r", encoding="utf-8") as in_f:
-            position = 0
-            token_id = ""
-            doc_id = ""
-            domain = ""
-            lines = in_f.readlines()
-            for i, line in enumerate(lines):
-                current_line = line.strip().split("\t")
-                if len(current_line) > 1:
-                    # Extract document id if available
-                    if doc_id_column is not None:
-                        doc_id = current_line[doc_id_column]
-                    else:
-                        doc_id = ""
-                    # Extract token id if exists
-                    if token_id_column:
-                        token_id = current_line[token_id_column]
-                    # We assume that the tag column is directly adjacent to the token column
-                    token = current_line[0]
-                    if n_tag_columns == 1:
-                        label = re.sub(r"[BI]-", "", current_line[1])
-                    else:
-                        label = [
-                            re.sub(r"[BI]-", "", tag)
-                            for tag in current_line[1 : n_tag_columns + 1]
-                        ]
-                    # Extract token_id and domain from BIO file if available
-                    if domain_column is not None:
-                        domain = current_line[domain_column].lower()
-                    yield Token(
-                        position=position,
-                        token_id=token_id,
-                        token=token,
-                        label=label,
-                        doc_id=doc_id,
-                        domain=domain,
-                    )
-                    position += 1
+        position = 0
+        token_id = ""
+        doc_id = ""
+        domain = ""
+        for current_line, _, range_position in self.stream(doc_id_column=doc_id_column):
+            if range_position is not None:
+                position = range_position
+            if len(current_line) > 1:
+                # Extract document id if available
+                if doc_id_column is not None:
+                    doc_id = current_line[doc_id_column]
+                else:
+                    doc_id = ""
+                # Extract token id if exists
+                if token_id_column:
+                    token_id = current_line[token_id_column]
+                # We assume that the tag column is directly adjacent to the token column
+                token = current_line[0]
+                if n_tag_columns == 1:
+                    label = re.sub(r"[BI]-", "", current_line[1])
+                else:
+                    label = [
+                        re.sub(r"[BI]-", "", tag)
+                        for tag in current_line[1 : n_tag_columns + 1]
+                    ]
+                # Extract token_id and domain from BIO file if available
+                if domain_column is not None:
+                    domain = current_line[domain_column].lower()
+                yield Token(
+                    position=position,
+                    token_id=token_id,
+                    token=token,
+                    label=label,
+                    doc_id=doc_id,
+                    domain=domain,
+                )
+                position += 1
 
 
     def extract_spans_from_iob(self, tag_column=1, doc_id_column: int | None = None):
@@ -135,56 +387,54 @@ class BioToSpanParser:
         :param doc_id_column:
         :param tag_column:
         """
-        with open(self.path_to_file, "r", encoding="utf-8") as in_f:
-            # doc_token_id is the predefined token_id in each document while token_id is the token position in the whole dataset
-            position = 0
-            start_position = 0
-            doc_id = ""
-            current_doc_id = ""
-            label = ""
-
-            lines = in_f.readlines()
-            for i, line in enumerate(lines):
-                current_line = line.strip().split("\t")
-            
-                # Extract next line if possible
-                try:
-                    next_line = lines[i + 1].strip().split("\t")
-                except IndexError:
-                    next_line = []
-
-                # Extract spans based on predicted tags
-                if len(current_line) > 1:
-                    if doc_id_column is not None:
-                        doc_id = current_line[doc_id_column]
-                    # Check if doc_id != current_doc_id
-                    if doc_id != "" and doc_id != current_doc_id:
-                        current_doc_id = doc_id
-                    current_tag = current_line[tag_column]
-                    # Start processing line if current tag is not "O"
-                    if current_tag != "O":
-                        current_label = re.sub(r"^[BI]-", "", current_tag)
-                        if label == "":
-                            # Begin of current span
-                            start_position = position
-                            label = current_label
-                        # Extract next label for comparison
-                        if len(next_line) > 1:
-                            next_tag = next_line[tag_column]
-                            next_label = re.sub(r"^[BI]-", "", next_tag)
-                        # Generate current span if next tag is 'O', if new span starts with 'B-' or
-                        # if new entity tag -> Doesn't matter if it starts with 'I-' instead of 'B-'
-                        if (
-                            len(next_line) == 1
-                            or next_line == []
-                            or next_tag.startswith("B-")
-                            or next_label != label
-                        ):
-                            yield ParsedSpan(
-                                position_start=start_position,
-                                position_end=position,
-                                doc_id=current_doc_id,
-                                head=tag_column,
-                            )
-                            label = ""
-                    position += 1
+        # doc_token_id is the predefined token_id in each document while token_id is the token position in the whole dataset
+        position = 0
+        start_position = 0
+        doc_id = ""
+        current_doc_id = ""
+        label = ""
+
+        for current_line, next_line, range_position in self.stream(doc_id_column=doc_id_column):
+            if range_position is not None:
+                position = range_position
+            # Extract spans based on predicted tags
+            if len(current_line) > 1:
+                if doc_id_column is not None:
+                    doc_id = current_line[doc_id_column]
+                # Check if doc_id != current_doc_id
+                if doc_id != "" and doc_id != current_doc_id:
+                    current_doc_id = doc_id
+                current_tag = current_line[tag_column]
+                # Start processing line if current tag is not "O"
+                if current_tag != "O":
+                    current_label = re.sub(r"^[BI]-", "", current_tag)
+                    if label == "":
+                        # Begin of current span
+                        start_position = position
+                        label = current_label
+                    # Extract next label for comparison
+                    if len(next_line) > 1:
+                        next_tag = next_line[tag_column]
+                        next_label = re.sub(r"^[BI]-", "", next_tag)
+                    # Generate current span if next tag is 'O', if new span starts with 'B-' or
+                    # if new entity tag -> Doesn't matter if it starts with 'I-' instead of 'B-'
+                    if (
+                        len(next_line) == 1
+                        or next_line == []
+                        or next_tag.startswith("B-")
+                        or next_label != label
+                    ):
+                        yield ParsedSpan(
+                            position_start=start_position,
+                            position_end=position,
+                            doc_id=current_doc_id,
+                            head=tag_column,
+                        )
+                        label = ""
+                position += 1
+
+
+def _parse_byte_range(path_to_file: str, byte_range: tuple[int, int, int], tag_columns: list[int], **columns):
+    """Parse a single byte range in a worker process."""
+    parser = BioToSpanParser(path_to_file, byte_ranges=[byte_range])
+    return parser.extract_spans_and_tokens_from_iob(tag_columns=tag_columns, **columns)
@@ -1,66 +1,65 @@
-import networkx as nx
+import numpy as np
 
-from itertools import chain
-from collections import  defaultdict
+from itertools import chain, groupby
 
-from .utils import majority_vote
-from .data import ParsedSpan, SpanComponent, UnifiedSpan, Token
+from .utils import segment_majority_vote
+from .data import ParsedSpan, SpanComponent, SpanTable, UnifiedSpan, TokenTable
 
 class MultiHeadSpanTokenUnifier:
-    def __init__(self, spans: list[SpanComponent], tokens: list[Token]):
+    def __init__(self, spans: list[SpanComponent], tokens: TokenTable):
         self.spans = spans
-        self.index_to_token_mapping = self.map_token_to_index(tokens)
+        self.tokens = tokens
 
     def __call__(self):
-        for span in self.spans:
-            concatenated_tokens = []
-            labels = []
-            token_id_start = 0
-            token_id_end = 0
-            domain = None
-            for position in range(span.position_start, span.position_end+1):
-                token = self.index_to_token_mapping.get(position)
-                domain = token.domain
-                if token.position == span.position_start:
-                    token_id_start = token.token_id
-                if token.position == span.position_end:
-                    token_id_end = token.token_id
-
-                labels.append(token.label)
-                concatenated_tokens.append(token.token)
-
-            if all(isinstance(label, list) for label in labels):
-                labels = self.transpose(labels)
-                majority_label = [majority_vote(label) for label in labels]
-            else:
-                majority_label = majority_vote(labels)
-
+        unified = self.unify()
+        for i, span in enumerate(self.spans):
+            label = unified["label"][i].tolist()
             yield UnifiedSpan(position_start=span.position_start,
                             position_end=span.position_end,
-                            token_id_start=token_id_start,
-                            token_id_end=token_id_end,
-                            text=" ".join(concatenated_tokens),
-                            label=majority_label,
+                            token_id_start=unified["token_id_start"][i],
+                            token_id_end=unified["token_id_end"][i],
+                            text=unified["text"][i],
+                            label=label[0] if self.tokens.n_heads == 1 else label,
                             doc_id=span.doc_id,
-                            domain=domain
+                            domain=unified["domain"][i]
                             )
 
-    @staticmethod
-    def transpose(labels: list[list[str]]):
+    def unify(self):
         """
-
-        :param labels:
-        :return:
+        Unify all spans at once. Majority labels of all spans are computed per head with a single segment reduction
+        over the label codes of the token table.
+        :return: Dictionary with one column per field of UnifiedSpan; labels as array of codes (spans x heads)
         """
-        return [list(row) for row in zip(*labels)]
+        position_start = np.array([span.position_start for span in self.spans], dtype=np.int64)
+        position_end = np.array([span.position_end for span in self.spans], dtype=np.int64)
+        unified = self.unify_positions(position_start, position_end, self.tokens)
+        unified["doc_id"] = [span.doc_id for span in self.spans]
+        return unified
 
     @staticmethod
-    def map_token_to_index(list_of_tokens:list[Token]):
-        mapping = defaultdict(Token)
-        for token in list_of_tokens:
-            mapping[token.position] = token
-        return mapping
-
+    def unify_positions(position_start: np.ndarray, position_end: np.ndarray, tokens: TokenTable):
+        """
+        Unify spans given as arrays of corpus positions (see unify()).
+        :param position_start: Corpus positions of first tokens
+        :param position_end: Corpus positions of last tokens
+        :param tokens: Token table covering all spans
+        :return: Dictionary with one column per field of UnifiedSpan except doc_id
+        """
+        row_start = np.searchsorted(tokens.position, position_start)
+        row_end = np.searchsorted(tokens.position, position_end)
+        label = np.stack(
+            [segment_majority_vote(tokens.label[:, head], row_start, row_end) for head in range(tokens.n_heads)],
+            axis=1
+        ) if position_start.size else np.zeros((0, tokens.n_heads), dtype=np.int32)
+        return {
+            "position_start": position_start,
+            "position_end": position_end,
+            "token_id_start": [tokens.token_id[row] for row in row_start],
+            "token_id_end": [tokens.token_id[row] for row in row_end],
+            "text": [tokens.token.join(start, end) for start, end in zip(row_start, row_end)],
+            "label": label,
+            "domain": [tokens.domain_vocabulary[code] for code in tokens.domain[row_end]],
+        }
 
 
 class OverlapComponentUnifier:
@@ -76,23 +75,49 @@ class OverlapComponentUnifier:
 
     def get_overlap_components(self):
         """
-
-        :return:
+        Divide spans into overlap components by sorting them per document and sweeping over start positions:
+        a span joins the current component if it starts at or before the component end, otherwise it opens a new one.
+        :return: List of components, each a list of spans
         """
         overlap_components = []
-        graph = nx.Graph()
-        for i, span in enumerate(self.spans):
-            graph.add_node(i, span=span)
-
-        for i, s1 in enumerate(self.spans):
-            for j, s2 in enumerate(self.spans[i+1:], start=i+1):
-                if self.overlap(s1, s2):
-                    graph.add_edge(i, j)
-
-        for component in nx.connected_components(graph):
-            overlap_components.append([graph.nodes[i]["span"] for i in component])
+        spans_by_doc_id = sorted(self.spans, key=lambda span: (str(span.doc_id), span.position_start, span.position_end))
+        for _, spans in groupby(spans_by_doc_id, key=lambda span: span.doc_id):
+            component_end = None
+            for span in spans:
+                if component_end is not None and span.position_start <= component_end:
+                    overlap_components[-1].append(span)
+                    component_end = max(component_end, span.position_end)
+                else:
+                    overlap_components.append([span])
+                    component_end = span.position_end
         return overlap_components
 
+    @staticmethod
+    def component_bounds(spans: SpanTable):
+        """
+        Overlap components of a span table in a single vectorised sweep, with the same components and order as
+        __call__(): spans are sorted by document, start and end; a span opens a new component if it belongs to another
+        document or starts after the largest end seen so far.
+        :param spans: SpanTable
+        :return: Arrays of start, end and document code of each component
+        """
+        if len(spans) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32)
+        # Rank of document codes in order of document IDs
+        doc_rank = np.argsort(np.argsort(np.array(spans.doc_id_vocabulary, dtype=object)))[spans.doc_id]
+        order = np.lexsort((spans.position_end, spans.position_start, doc_rank))
+        # Shift positions of each document beyond those of the previous one, so a running maximum never crosses documents
+        offset = doc_rank[order] * (int(spans.position_end.max()) + 2)
+        start, end = spans.position_start[order] + offset, spans.position_end[order] + offset
+        is_first = np.ones(order.size, dtype=bool)
+        is_first[1:] = start[1:] > np.maximum.accumulate(end)[:-1]
+        first = np.flatnonzero(is_first)
+        return (
+            spans.position_start[order][first],
+            np.maximum.reduceat(spans.position_end[order], first),
+            spans.doc_id[order][first],
+        )
+
     @staticmethod
     def combined_span_from_component(component: list[ParsedSpan]):
         """
@@ -1,3 +1,5 @@
+import numpy as np
+
 from collections import Counter
 
 def majority_vote(labels: list[str]):
@@ -7,4 +9,27 @@ def majority_vote(labels: list[str]):
     :return: Most common NER label as string
     """
     counter = Counter(labels)
-    return counter.most_common(1)[0][0]
\ No newline at end of file
+    return counter.most_common(1)[0][0]
+
+
+def segment_majority_vote(codes: np.ndarray, starts: np.ndarray, ends: np.ndarray):
+    """
+    Determine the most common code in each segment codes[start:end + 1] at once. As in majority_vote,
+    ties are broken in favour of the code that occurs first in the segment.
+    :param codes: Integer codes
+    :param starts: Index of first element of each segment
+    :param ends: Index of last element of each segment (segments must not be empty)
+    :return: Array with the most common code of each segment
+    """
+    lengths = ends - starts + 1
+    if lengths.size == 0:
+        return np.zeros(0, dtype=codes.dtype)
+    segments = np.repeat(np.arange(lengths.size), lengths)
+    indices = np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    n_codes = int(codes.max()) + 1
+    # Count each (segment, code) pair and remember where it occurs first
+    keys, first, counts = np.unique(segments * n_codes + codes[indices], return_index=True, return_counts=True)
+    order = np.lexsort((first, -counts, keys // n_codes))
+    is_winner = np.ones(order.size, dtype=bool)
+    is_winner[1:] = keys[order[1:]] // n_codes != keys[order[:-1]] // n_codes
+    return (keys[order[is_winner]] % n_codes).astype(codes.dtype)
@@ -35,14 +35,13 @@ setup(
     scripts=[
         'bin/cluevaluate',
     ],
-    python_requires='>=3.9.0',
+    python_requires='>=3.10.0',
     install_requires=install_requires,
     classifiers=[
         "License :: OSI Approved :: GNU General Public License v3 or later (GPLv3+)",
         "Development Status :: 3 - Alpha",
         "Operating System :: Unix",
         "Programming Language :: Python :: 3",
-        'Programming Language :: Python :: 3.9',
         'Programming Language :: Python :: 3.10',
         'Programming Language :: Python :: 3.11'
     ],
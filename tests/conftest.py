@@ -1,6 +1,8 @@
 import pytest
 import pandas as pd
 
+from clueval.evaluation import evaluate
+
 
 @pytest.fixture
 def p1():
@@ -34,3 +36,13 @@ def precision_table():
 def recall_table():
     """ prepared recall table """
     return pd.read_csv("tests/data/recall_table.tsv", sep="\t")
+
+@pytest.fixture
+def split_match_tables():
+    """ precision and recall tables of a candidate, with the single test document split into 5 pseudo-documents """
+    def match_tables(path_reference: str, path_candidate: str):
+        precision, recall, _ = evaluate(path_reference, path_candidate, annotation_layer="span")
+        precision["doc_id"] = (precision["start"] % 5).astype(str)
+        recall["doc_id"] = (recall["start"] % 5).astype(str)
+        return precision, recall
+    return match_tables
@@ -1,4 +1,11 @@
-from clueval.spans_table import Convert, Match
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+from clueval.spans_table import Convert, Match, OverlapComponentUnifier, ParsedSpan, SpanTable
+from clueval.spans_table.cache import SpansTableCache
+from clueval.spans_table.utils import majority_vote, segment_majority_vote
 # import pytest
 
 # TODO: Revise test and integrate recall and precision.tsv from SE. Or in test_evaluation.
@@ -55,6 +62,33 @@ def test_converter(p1):
     assert df["domain"].unique()[0] == "fictitious_domain"
 
 
+def test_converter_head_wise():
+    converter = Convert("tests/data/fiktives-urteil-p1.bio", annotation_layer=["anon", "entity", "risk"])
+    anon_df, entity_df = converter(head=1), converter(head=2)
+
+    # test number of spans; the entity layer splits some spans of the anon layer
+    assert anon_df.shape[0] == 69
+    assert entity_df.shape[0] == 71
+
+    # test span boundaries and labels of the selected head
+    selected = anon_df["start"].between(505, 580)
+    assert anon_df.loc[selected, "start"].tolist() == [505, 574]
+    assert anon_df.loc[selected, "end"].tolist() == [507, 576]
+    assert anon_df.loc[selected, "label"].tolist() == ["anon", "anon"]
+    assert anon_df.loc[selected, "text"].tolist() == ["30. 07. 2020", "Sunfun Pergola XL"]
+
+    selected = entity_df["start"].between(505, 580)
+    assert entity_df.loc[selected, "start"].tolist() == [505, 574, 575]
+    assert entity_df.loc[selected, "end"].tolist() == [507, 574, 576]
+    assert entity_df.loc[selected, "label"].tolist() == ["date-fact", "address-idx", "jur-idx"]
+    assert entity_df.loc[selected, "text"].tolist() == ["30. 07. 2020", "Sunfun", "Pergola XL"]
+
+    # test spans are sorted with consecutive IDs
+    assert entity_df["start"].is_monotonic_increasing
+    assert entity_df["id"][0] == "id000001"
+    assert entity_df["id"].is_unique
+
+
 def test_match(p1, p2, precision_table, recall_table):
     p1_converter = Convert(p1, annotation_layer=["confidence"],token_id_column=2, doc_id_column=3, domain_column=4)
     p2_converter = Convert(p2, annotation_layer=["confidence"], token_id_column=2, doc_id_column=3, domain_column=4)
@@ -108,3 +142,134 @@ def test_match(p1, p2, precision_table, recall_table):
     assert precision_match["token_id_end"][0] == precision_table["token_id_end"][0]
     assert precision_match["token_id_end"].iloc[-1] == precision_table["token_id_end"].iloc[-1]
 
+
+
+def test_converter_cache(p1, tmp_path):
+    path = shutil.copy(p1, tmp_path / "reference.bio")
+    cache_dir = tmp_path / "cache"
+    df = Convert(path, annotation_layer=["confidence"], token_id_column=2, doc_id_column=3, domain_column=4, cache_dir=cache_dir)()
+    assert len(list(cache_dir.glob("*.pkl"))) == 1
+
+    # second conversion is loaded from cache
+    cached_df = Convert(path, annotation_layer=["confidence"], token_id_column=2, doc_id_column=3, domain_column=4, cache_dir=cache_dir)()
+    pd.testing.assert_frame_equal(df, cached_df)
+
+    # damaged entries are treated as missing and replaced
+    entry = next(cache_dir.glob("*.pkl"))
+    with open(entry, "r+b") as entry_f:
+        entry_f.truncate(entry.stat().st_size // 2)
+    cached_df = Convert(path, annotation_layer=["confidence"], token_id_column=2, doc_id_column=3, domain_column=4, cache_dir=cache_dir)()
+    pd.testing.assert_frame_equal(df, cached_df)
+    pd.testing.assert_frame_equal(df, pd.read_pickle(entry))
+
+    # different parameters and changed files are new entries
+    Convert(path, annotation_layer=["confidence"], cache_dir=cache_dir)()
+    assert len(list(cache_dir.glob("*.pkl"))) == 2
+    with open(path, "a", encoding="utf-8") as out_f:
+        out_f.write("Erlangen\tB-hoch\ttoken_81\tfictitious_1512\tFictitious_Domain\n")
+    changed_df = Convert(path, annotation_layer=["confidence"], token_id_column=2, doc_id_column=3, domain_column=4, cache_dir=cache_dir)()
+    assert changed_df.shape[0] == df.shape[0] + 1
+    assert len(list(cache_dir.glob("*.pkl"))) == 3
+
+    # least recently used entries are evicted
+    cache = SpansTableCache(cache_dir, max_size=1)
+    cache.evict()
+    assert len(list(cache_dir.glob("*.pkl"))) == 0
+
+
+def test_converter_cache_concurrent_eviction(p1, tmp_path, monkeypatch):
+    cache = SpansTableCache(tmp_path / "cache", max_size=1)
+    df = Convert(p1, annotation_layer=["confidence"])()
+    cache.put("loaded", df)
+
+    # entry evicted by another process after loading is still returned
+    def evicted(path, *args, **kwargs):
+        raise FileNotFoundError(path)
+    with monkeypatch.context() as patch:
+        patch.setattr(os, "utime", evicted)
+        pd.testing.assert_frame_equal(cache.get("loaded"), df)
+
+    # entries evicted by another process while listing are skipped
+    listdir = os.listdir
+    monkeypatch.setattr(os, "listdir", lambda path: listdir(path) + ["evicted.pkl"])
+    cache.evict()
+    assert len(list((tmp_path / "cache").glob("*.pkl"))) == 0
+
+
+def test_overlap_components():
+    spans = [ParsedSpan(5, 6, "doc_1", 1), ParsedSpan(0, 2, "doc_1", 1), ParsedSpan(2, 3, "doc_1", 2),
+             ParsedSpan(4, 4, "doc_1", 2), ParsedSpan(3, 3, "doc_2", 1), ParsedSpan(6, 9, "doc_1", 2)]
+    components = OverlapComponentUnifier(spans)()
+    assert [(span.position_start, span.position_end, span.doc_id) for span in components] == [
+        (0, 3, "doc_1"), (3, 3, "doc_2"), (4, 4, "doc_1"), (5, 9, "doc_1")
+    ]
+
+    # vectorised sweep over a span table finds the same components, ordered by document
+    vocabulary = ["doc_2", "doc_1"]
+    span_table = SpanTable(
+        position_start=np.array([span.position_start for span in spans]),
+        position_end=np.array([span.position_end for span in spans]),
+        head=np.array([span.head for span in spans], dtype=np.int32),
+        doc_id=np.array([vocabulary.index(span.doc_id) for span in spans], dtype=np.int32),
+        doc_id_vocabulary=vocabulary,
+    )
+    starts, ends, doc_ids = OverlapComponentUnifier.component_bounds(span_table)
+    assert list(zip(starts.tolist(), ends.tolist(), [vocabulary[code] for code in doc_ids])) == [
+        (0, 3, "doc_1"), (4, 4, "doc_1"), (5, 9, "doc_1"), (3, 3, "doc_2")
+    ]
+
+
+def test_segment_majority_vote():
+    codes = np.array([2, 1, 1, 0, 2, 0, 3, 3, 1], dtype=np.int32)
+    starts, ends = np.array([0, 3, 6, 8, 0]), np.array([2, 5, 7, 8, 8])
+    majority = segment_majority_vote(codes, starts, ends)
+    assert majority.tolist() == [majority_vote(codes[s:e + 1].tolist()) for s, e in zip(starts, ends)] == [1, 0, 3, 1, 1]
+
+
+def test_match_overlap():
+    def spans_table(spans, prefix):
+        return pd.DataFrame({
+            "start": [start for start, _, _ in spans], "end": [end for _, end, _ in spans],
+            "token_id_start": [str(start) for start, _, _ in spans], "token_id_end": [str(end) for _, end, _ in spans],
+            "text": [" ".join(f"t{i}" for i in range(start, end + 1)) for start, end, _ in spans],
+            "doc_id": "doc", "domain": "zivil", "label": [label for _, _, label in spans],
+            "id": [f"{prefix}{i}" for i in range(len(spans))],
+        })
+    x = spans_table([(0, 3, "A"), (10, 11, "B"), (20, 25, "C"), (30, 31, "A")], "x")
+    y = spans_table([(0, 1, "B"), (2, 3, "A"), (9, 10, "C"), (11, 12, "B"), (20, 21, "A"), (24, 26, "B"), (31, 31, "A")], "y")
+    match_df = Match(x, y, annotation_layer="label")(on=["start", "end"])
+    assert match_df["status"].tolist() == ["tiled", "covered", "unmatched", "unmatched"]
+    assert match_df["text_Y"].tolist() == ["t0 t1 | t2 t3", "t9 t10 | t11 t12", "", ""]
+    assert match_df["label_Y"].tolist() == ["B", "C", "FN", "A"]
+    assert match_df["start_Y"].tolist() == [0, 9, -100, 31]
+
+
+def test_match_partitioned(p1, p2):
+    ref = Convert(p1, annotation_layer=["confidence"], token_id_column=2, doc_id_column=3, domain_column=4)(id_prefix="ref")
+    cand = Convert(p2, annotation_layer=["confidence"], token_id_column=2, doc_id_column=3, domain_column=4)(id_prefix="cand")
+    match = Match(ref, cand, annotation_layer=["confidence"], n_jobs=2)
+    partitions = match.partition(4)
+    assert sum(x.shape[0] for x, _ in partitions) == ref.shape[0]
+    assert all(set(x["doc_id"]) == set(y["doc_id"]) for x, y in partitions if not y.empty)
+
+    recall_match = Match(ref, cand, annotation_layer=["confidence"])(on=["start", "end"])
+    assert match(on=["start", "end"]).equals(recall_match)
+
+
+def test_match_bidirectional(p1, p2):
+    ref = Convert(p1, annotation_layer=["confidence"], token_id_column=2, doc_id_column=3, domain_column=4)(id_prefix="ref")
+    cand = Convert(p2, annotation_layer=["confidence"], token_id_column=2, doc_id_column=3, domain_column=4)(id_prefix="cand")
+    recall_match, precision_match = Match(ref, cand, annotation_layer=["confidence"]).bidirectional(on=["start", "end"])
+    assert recall_match.equals(Match(ref, cand, annotation_layer=["confidence"])(on=["start", "end"]))
+    assert precision_match.equals(Match(cand, ref, annotation_layer=["confidence"])(on=["start", "end"]))
+
+
+def test_match_overlap_label_from_longest_intersection():
+    # Repeated tokens must not be counted as shared with x if they lie outside of x
+    columns = ["start", "end", "token_id_start", "token_id_end", "text", "doc_id", "domain", "label", "id"]
+    x = pd.DataFrame([[2, 5, "2", "5", "der Mann Mann Mann", "doc", "zivil", "A", "x0"]], columns=columns)
+    y = pd.DataFrame([[0, 2, "0", "2", "der der der", "doc", "zivil", "B", "y0"],
+                      [3, 5, "3", "5", "Mann Mann Mann", "doc", "zivil", "C", "y1"]], columns=columns)
+    match_df = Match(x, y, annotation_layer="label")(on=["start", "end"])
+    assert match_df["status"].tolist() == ["covered"]
+    assert match_df["label_Y"].tolist() == ["C"]
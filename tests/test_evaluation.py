@@ -1,5 +1,8 @@
+import shutil
+import pytest
 import pandas as pd
-from clueval.evaluation import evaluate
+from clueval.evaluation import evaluate, MetricsForSpansAnonymisation, MetricsForCategoricalSpansAnonymisation, BootstrapMetrics, PairedSignificanceTest
+from clueval.evaluation import compare_candidates
 
 
 def test_evaluate(p1, p2):
@@ -104,3 +107,103 @@ def test_categorical_evaluation(p1, p2, precision_table, recall_table):
     assert categorical_evaluation[categorical_evaluation["Label"] == "Mittel"]["FP"].values == precision_table.loc[(precision_table["Risk"] == "mittel") & (precision_table["status"] != "exact")].shape[0]
     assert categorical_evaluation[categorical_evaluation["Label"] == "Niedrig"]["TP_Precision"].values == precision_table.loc[(precision_table["Risk"] == "niedrig") & (precision_table["status"] == "exact")].shape[0]
     assert categorical_evaluation[categorical_evaluation["Label"] == "Niedrig"]["FP"].values == precision_table.loc[(precision_table["Risk"] == "niedrig") & (precision_table["status"] != "exact")].shape[0]
+
+
+def test_evaluate_parallel(p1, p2, tmp_path):
+    # Parallel conversion persists an index next to the input files
+    p1, p2 = shutil.copy(p1, tmp_path), shutil.copy(p2, tmp_path)
+    precision, recall, span_evaluation = evaluate(p1, p2, annotation_layer="confidence", doc_id_column=3)
+    parallel_precision, parallel_recall, parallel_span_evaluation = evaluate(
+        p1, p2, annotation_layer="confidence", doc_id_column=3, n_jobs=2
+    )
+    assert parallel_precision.equals(precision) and parallel_recall.equals(recall)
+    assert parallel_span_evaluation.equals(span_evaluation)
+
+
+def test_span_evaluation_all_levels(p1, p2):
+    precision, recall, _ = evaluate(p1, p2, annotation_layer="confidence")
+    metrics = MetricsForSpansAnonymisation(precision_table=precision, recall_table=recall)
+    all_levels = metrics.all_levels(row_name="Span")
+    assert all_levels.index.tolist() == [0, 1, 2, 3]
+    for level in range(4):
+        assert all_levels.loc[[level]].reset_index(drop=True).equals(metrics(lenient_level=level, row_name="Span").reset_index(drop=True))
+    assert (all_levels["TP_Recall"].diff().dropna() >= 0).all()
+
+    # evaluate() reports every row of the evaluation table at all levels
+    kwargs = dict(annotation_layer="confidence", domain_column=4, group_by="domain", categorical_evaluation=True, categorical_head="confidence")
+    _, _, evaluation = evaluate(p1, p2, all_levels=True, **kwargs)
+    assert evaluation["Lenient"].unique().tolist() == [0, 1, 2, 3]
+    assert evaluation.loc[evaluation["Level"] == "Span", "TP_Recall"].tolist() == all_levels["TP_Recall"].tolist()
+    for level in range(4):
+        _, _, level_evaluation = evaluate(p1, p2, lenient_level=level, **kwargs)
+        selected = evaluation[evaluation["Lenient"] == level].drop(columns="Lenient").reset_index(drop=True)
+        assert selected.equals(level_evaluation)
+
+
+def test_confusion_matrix(p1, p2):
+    precision, recall, _ = evaluate(p1, p2, annotation_layer="confidence")
+    metrics = MetricsForCategoricalSpansAnonymisation(precision, recall, classification_head="confidence")
+    categorical_metrics = metrics(lenient_level=1)
+    confusion_matrix = metrics.confusion_matrix(lenient_level=1)
+    assert confusion_matrix.sum().sum() == recall.shape[0] + (~precision["status"].isin(["exact", "contained"])).sum()
+    for category in metrics.categories:
+        assert confusion_matrix.loc[category, category] == categorical_metrics.loc[category.capitalize(), "TP_Recall"]
+
+
+def test_bootstrap(p1, p2, split_match_tables):
+    precision, recall, _ = evaluate(p1, p2, annotation_layer="span")
+    with pytest.raises(ValueError):
+        BootstrapMetrics(precision, recall, unit="document")(n_resamples=200)
+    with pytest.raises(ValueError):
+        BootstrapMetrics(precision, recall, unit="span")(n_resamples=0)
+    precision, recall = split_match_tables(p1, p2)
+    categorical_metrics = MetricsForCategoricalSpansAnonymisation(precision, recall, classification_head="span")(lenient_level=1)
+    for unit in ["document", "span"]:
+        bootstrap = BootstrapMetrics(precision, recall, categorical_head="span", unit=unit)
+        ci = bootstrap(n_resamples=200, seed=1)
+        assert ci.shape[0] == 4 * (1 + len(bootstrap.categorical_metrics["span"].categories))
+        assert ci.equals(bootstrap(n_resamples=200, seed=1))
+        assert (ci["P_lower"] <= ci["P_upper"]).all() and (ci["F1_lower"] <= ci["F1_upper"]).all()
+        level_1 = ci[(ci["Lenient"] == 1) & (ci["Level"] == "span")].set_index("Label")
+        pd.testing.assert_series_equal(level_1["P"], categorical_metrics["P"], check_names=False, check_index_type=False)
+        pd.testing.assert_series_equal(level_1["R"], categorical_metrics["R"], check_names=False, check_index_type=False)
+
+
+def test_paired_significance(p1, p2, split_match_tables):
+    with pytest.raises(ValueError):
+        compare_candidates(p1, p2, p1, annotation_layer="span", method="bootstrap")
+    precision, recall, _ = evaluate(p1, p2, annotation_layer="span")
+    with pytest.raises(ValueError):
+        PairedSignificanceTest(precision, recall, precision, recall)(method="bootstrap")
+    tables = {"a": split_match_tables(p1, p2), "b": split_match_tables(p1, p1)}
+    _, _, span_evaluation = evaluate(p1, p2, annotation_layer="span", lenient_level=2)
+    for method in ["permutation", "bootstrap"]:
+        same = PairedSignificanceTest(*tables["a"], *tables["a"])(method=method, n_resamples=200, seed=1)
+        assert (same["Delta"] == 0).all() and (same["p_value"] == 1).all()
+        test = PairedSignificanceTest(*tables["a"], *tables["b"])
+        result = test(method=method, n_resamples=200, seed=1)
+        assert result.equals(test(method=method, n_resamples=200, seed=1))
+        assert (result["F1_B"] == 100).all()
+        assert result.loc[2, "F1_A"] == span_evaluation.loc[0, "F1"]
+        assert ((result["p_value"] > 0) & (result["p_value"] < 1)).all()
+    with pytest.raises(ValueError):
+        PairedSignificanceTest(*tables["a"], *tables["b"])(n_resamples=0)
+
+
+def test_evaluate_group_by(p1, p2):
+    *_, span_evaluation = evaluate(p1, p2, annotation_layer="span", doc_id_column=3, domain_column=4, group_by=["doc_id", "domain"], lenient_level=1)
+    assert span_evaluation["Level"].tolist() == ["Span", "doc_id", "domain"]
+    assert span_evaluation["Label"].tolist() == ["Span", "fictitious_1512", "fictitious_domain"]
+    columns = ["P", "R", "F1", "TP_Precision", "TP_Recall", "FP", "FN", "Support"]
+    assert (span_evaluation.loc[1:, columns] == span_evaluation.loc[0, columns]).all().all()
+
+
+def test_span_evaluation_by_group(p1, p2, split_match_tables):
+    precision, recall = split_match_tables(p1, p2)
+    metrics = MetricsForSpansAnonymisation(precision, recall)
+    group_metrics = metrics.by_group("doc_id", lenient_level=2)
+    span_metrics = metrics(lenient_level=2, row_name="Span")
+    for column in ["TP_Precision", "TP_Recall", "FP", "FN", "Support"]:
+        assert group_metrics[column].sum() == span_metrics.loc["Span", column]
+    subset = MetricsForSpansAnonymisation(precision[precision["doc_id"] == "1"], recall[recall["doc_id"] == "1"])
+    pd.testing.assert_series_equal(group_metrics.loc["1"], subset(lenient_level=2, row_name="1").drop(columns="row_name").loc["1"], check_dtype=False)
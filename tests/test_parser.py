@@ -1,4 +1,11 @@
-from clueval.spans_table import BioToSentenceParser, BioToSpanParser
+import os
+import shutil
+import pytest
+
+from clueval.spans_table import BioToSentenceParser, BioToSpanParser, SentenceIndex
+from clueval.spans_table.data import LabelVocabulary
+from clueval.spans_table.index import VrtIndex
+from clueval.spans_table.parser import stream_lines_with_lookahead
 
 def test_bio_to_sentence(p1):
     pos_to_sent_mapping = BioToSentenceParser(p1)()
@@ -12,6 +19,121 @@ def test_bio_to_sentence(p1):
 
     assert pos_to_sent_mapping["sents"][0][0] == pos_to_sent_mapping["sents"][0][-1]
 
+def test_sentence_index(p1):
+    pos_to_sent_mapping = BioToSentenceParser(p1)()
+    sentence_index = BioToSentenceParser(p1)(compact=True)
+    assert len(sentence_index) == len(SentenceIndex.from_mapping(pos_to_sent_mapping)) == 8
+
+    for i, (token_ids, sent) in enumerate(zip(pos_to_sent_mapping["token_ids"], pos_to_sent_mapping["sents"])):
+        positions, tokens = sentence_index.sentence(i)
+        assert positions.tolist() == token_ids
+        assert tokens == sent
+        assert sentence_index.sentence_of(token_ids[-1]) == i
+    assert sentence_index.sentence_of(-1) is None
+
 def test_bio_to_span_parser(p1):
     pos_to_span_mapping = BioToSpanParser(p1)()
     pass
+
+
+def test_bio_to_span_parser_single_pass():
+    path = "tests/data/fiktives-urteil-p1.bio"
+    parser = BioToSpanParser(path)
+    spans, tokens = parser(tag_column=[1, 2, 3], extract_tokens=True)
+
+    # spans are identical to the ones extracted column by column
+    expected_spans = [span for tag_column in [1, 2, 3] for span in parser.extract_spans_from_iob(tag_column=tag_column)]
+    assert spans == expected_spans
+    assert {span.head for span in spans} == {1, 2, 3}
+
+    # tokens carry one label per tag column
+    expected_tokens = list(parser.extract_tokens_from_iob(n_tag_columns=3))
+    assert list(tokens.to_tokens()) == expected_tokens
+    assert tokens.labels_of(1) == ["anon", "court-name", "niedrig"]
+    assert tokens.token.join(1, 2) == "AMTSGERICHT ERLANGEN"
+
+    # compact spans hold the same spans as columns
+    span_table, _ = parser(tag_column=[1, 2, 3], compact=True)
+    assert len(span_table) == len(spans)
+    assert list(span_table.to_spans()) == spans
+
+    # same return types as the single-column path without tokens
+    assert parser(tag_column=[1, 2, 3])[1] == parser(tag_column=1)[1] == []
+
+
+def test_stream_lines_with_lookahead(p1s):
+    lines = list(stream_lines_with_lookahead(p1s))
+    with open(p1s, "r", encoding="utf-8") as in_f:
+        expected = [line.strip().split("\t") for line in in_f]
+    assert [current_line for current_line, _ in lines] == expected
+    assert [next_line for _, next_line in lines] == expected[1:] + [[]]
+
+
+def test_label_vocabulary():
+    vocabulary = LabelVocabulary()
+    assert vocabulary.lookup("B-court-name") == ("B", 0)
+    assert vocabulary.lookup("I-court-name") == ("I", 0)
+    assert vocabulary.lookup("O") == ("", 1)
+    assert vocabulary.lookup("B-PII-data") == ("B", 2)
+    assert vocabulary.labels == ["court-name", "O", "PII-data"]
+    assert vocabulary[2] == "PII-data"
+
+
+@pytest.mark.filterwarnings("error::ResourceWarning", "error::pytest.PytestUnraisableExceptionWarning")
+def test_vrt_index(p1, tmp_path):
+    path = shutil.copy(p1, tmp_path)
+    index = VrtIndex.load_or_build(path, doc_id_column=3)
+    assert os.path.exists(path + VrtIndex.suffix)
+    assert index.doc_ids == ["fictitious_1512"]
+    assert index.doc_offsets.tolist() == [0, os.path.getsize(path)]
+    assert index.doc_positions.tolist() == [0, 81]
+    assert index.sentence_positions[:3].tolist() == [0, 4, 9]
+
+    # persisted index is reused, and rebuilt for a different doc_id_column
+    assert VrtIndex.load_or_build(path, doc_id_column=3).doc_ids == ["fictitious_1512"]
+    assert VrtIndex.load_or_build(path).doc_ids == []
+
+    # damaged index is rebuilt
+    with open(path + VrtIndex.suffix, "r+b") as index_f:
+        index_f.truncate(100)
+    assert VrtIndex.load_or_build(path, doc_id_column=3).doc_ids == ["fictitious_1512"]
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_bio_to_span_parser_doc_ids(tmp_path):
+    # Combine two documents into one file
+    path = tmp_path / "combined.bio"
+    with open(path, "w", encoding="utf-8") as out_f:
+        for doc_id, file in [("doc_1", "tests/data/reference-short.bio"), ("doc_2", "tests/data/reference.bio")]:
+            with open(file, "r", encoding="utf-8") as in_f:
+                for line in in_f:
+                    columns = line.strip().split("\t")
+                    out_f.write("\t".join(columns[:3] + [doc_id] + columns[4:]) + "\n" if len(columns) > 1 else "\n")
+    path = str(path)
+
+    full_spans, full_tokens = BioToSpanParser(path)(tag_column=[1], doc_id_column=3, extract_tokens=True)
+    spans, tokens = BioToSpanParser(path, doc_ids=["doc_2"])(tag_column=[1], doc_id_column=3, extract_tokens=True)
+
+    # corpus positions are the same as in the complete file
+    assert spans == [span for span in full_spans if span.doc_id == "doc_2"]
+    assert list(tokens.to_tokens()) == [token for token in full_tokens.to_tokens() if token.doc_id == "doc_2"]
+
+    sentences = BioToSentenceParser(path, doc_ids=["doc_2"], doc_id_column=3)()
+    assert sentences["token_ids"][0][0] == tokens.position[0]
+
+
+def test_bio_to_span_parser_parallel(p1, tmp_path):
+    path = shutil.copy(p1, tmp_path)
+    serial_spans, serial_tokens = BioToSpanParser(path)(tag_column=[1], doc_id_column=3, extract_tokens=True)
+    parser = BioToSpanParser(path, n_jobs=2)
+    assert len(parser.split_byte_ranges(4, doc_id_column=3)) == 4
+
+    spans, tokens = parser(tag_column=[1], doc_id_column=3, extract_tokens=True)
+    assert spans == serial_spans
+    assert list(tokens.to_tokens()) == list(serial_tokens.to_tokens())
+
+    # spans of several tag columns are grouped by tag column as in the serial parser
+    path = shutil.copy("tests/data/fiktives-urteil-p1.bio", tmp_path)
+    serial_table, _ = BioToSpanParser(path)(tag_column=[3, 1, 2], compact=True)
+    span_table, _ = BioToSpanParser(path, n_jobs=2)(tag_column=[3, 1, 2], compact=True)
+    assert list(span_table.to_spans()) == list(serial_table.to_spans())